@@ -113,6 +113,45 @@ public class WebSocketClient : MonoBehaviour
         }
     }
 
+    public async void SubscribeStreamData()
+    {
+        if (websocket != null && websocket.State == WebSocketState.Open)
+        {
+            currentStream = streamRequestInput.text;
+            var message = new Dictionary<string, string>
+            {
+                { "command", "subscribe_stream" },
+                { "client_id", clientId },
+                { "stream_name", currentStream }
+            };
+            await websocket.SendText(JsonConvert.SerializeObject(message));
+            Log("Subscribed to stream: " + currentStream);
+        }
+        else
+        {
+            Log("WebSocket is not connected.");
+        }
+    }
+
+    public async void UnsubscribeStreamData()
+    {
+        if (websocket != null && websocket.State == WebSocketState.Open)
+        {
+            var message = new Dictionary<string, string>
+            {
+                { "command", "unsubscribe_stream" },
+                { "client_id", clientId },
+                { "stream_name", currentStream }
+            };
+            await websocket.SendText(JsonConvert.SerializeObject(message));
+            Log("Unsubscribed from stream: " + currentStream);
+        }
+        else
+        {
+            Log("WebSocket is not connected.");
+        }
+    }
+
     private void HandleServerMessage(string message)
     {
         try
@@ -0,0 +1,68 @@
+"""Micro-benchmark for the per-broadcast CPU cost of WebSocketServer.
+
+Broadcasts go to in-memory connections, so this measures serialization and
+queueing only, with no network involved. Run it from the py_Server folder:
+
+    python bench_broadcast.py --clients 1 10 100 1000 --rounds 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from client_connection import ClientConnection
+from websocket_server import WebSocketServer
+
+
+class NullSocket:
+    async def send(self, message):
+        pass
+
+    async def close(self):
+        pass
+
+
+def encode_per_client(server, message):
+    """The previous broadcast path: one json.dumps per recipient."""
+    for cid, connection in server.clients.items():
+        connection.send(json.dumps({"command": "broadcast", "data": message}))
+
+
+async def measure(server, broadcast, rounds):
+    message = {"sensor": "esp32Stream1", "values": [1.25, 2.5, 3.75], "note": "benchmark payload"}
+    start = time.process_time()
+    for _ in range(rounds):
+        await broadcast(message)
+        # Keep queues from saturating so every round does the same amount of work
+        for connection in server.clients.values():
+            connection.queue.clear()
+    return (time.process_time() - start) / rounds
+
+
+async def run(client_counts, rounds):
+    print(f"{'clients':>8} {'per-client encode (us)':>24} {'encode once (us)':>18} {'speedup':>8}")
+    for count in client_counts:
+        server = WebSocketServer()
+        for i in range(count):
+            server.clients[f"client{i}"] = ClientConnection(f"client{i}", NullSocket(), max_queue=rounds + 1)
+
+        async def legacy(message):
+            encode_per_client(server, message)
+
+        before = await measure(server, legacy, rounds)
+        after = await measure(server, server.broadcast_message, rounds)
+        print(f"{count:>8} {before * 1e6:>24.1f} {after * 1e6:>18.1f} {before / after:>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.clients, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
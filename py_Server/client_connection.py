@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import websockets
+
+# Overflow policies for a client's outbound queue
+DROP_OLDEST = "drop_oldest"  # Discard the oldest queued message to make room
+COALESCE = "coalesce"  # Keep only the latest queued message per stream, then drop oldest
+DISCONNECT = "disconnect"  # Close the connection of a client that cannot keep up
+
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+class ClientConnection:
+    """A connected client with its own bounded outbound queue and writer task.
+
+    Messages are queued with `send` and written to the socket by a dedicated
+    task, so a slow client never blocks the sender or other clients.
+    """
+
+    def __init__(self, client_id, websocket, max_queue=256, overflow_policy=DROP_OLDEST):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.client_id = client_id
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.queue = deque()  # Entries are [key, message]; key is the stream name or None
+        self.pending = {}  # Stream name -> queued entry, used by the coalesce policy
+        self.dropped = 0  # Number of messages discarded because the queue was full
+        self.closed = False
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()  # Set whenever the queue has been fully written
+        self.idle.set()
+        self.writer_task = None
+        self.last_seen = time.monotonic()  # When the client last sent anything, pongs included
+
+    def start(self):
+        """Start the writer task on the running event loop."""
+        self.writer_task = asyncio.ensure_future(self.writer())
+        return self.writer_task
+
+    def send(self, message, key=None):
+        """Queue a message for delivery without waiting for the socket.
+
+        `key` identifies the stream the message belongs to, which lets the
+        coalesce policy replace a stale value with the latest one.
+        """
+        if self.closed:
+            return False
+
+        if self.overflow_policy == COALESCE and key is not None:
+            entry = self.pending.get(key)
+            if entry is not None:
+                entry[1] = message
+                return True
+
+        if len(self.queue) >= self.max_queue:
+            if self.overflow_policy == DISCONNECT:
+                logging.warning(f"Client {self.client_id} send queue full, disconnecting")
+                self.close()
+                return False
+            self.pop_oldest()
+            self.dropped += 1
+
+        entry = [key, message]
+        self.queue.append(entry)
+        if self.overflow_policy == COALESCE and key is not None:
+            self.pending[key] = entry
+        self.idle.clear()
+        self.wakeup.set()
+        return True
+
+    def pop_oldest(self):
+        entry = self.queue.popleft()
+        key = entry[0]
+        if key is not None and self.pending.get(key) is entry:
+            del self.pending[key]
+        return entry[1]
+
+    async def writer(self):
+        """Drain the queue to the socket until the connection is closed."""
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.idle.set()
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                message = self.pop_oldest()
+                await self.websocket.send(message)
+        except websockets.ConnectionClosed:
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.closed = True
+            self.queue.clear()
+            self.pending.clear()
+            self.idle.set()
+
+    def close(self):
+        """Stop the writer and close the underlying socket."""
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.idle.set()
+        asyncio.ensure_future(self.websocket.close())
+
+    def abort(self):
+        """Drop a dead connection at once, without waiting for a close handshake."""
+        self.closed = True
+        self.wakeup.set()
+        self.idle.set()
+        transport = getattr(self.websocket, "transport", None)
+        if transport is not None:
+            transport.abort()
+        else:
+            asyncio.ensure_future(self.websocket.close())
+
+    async def flush(self, timeout=None):
+        """Wait until everything queued so far has been written."""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Timed out flushing messages to {self.client_id}")
+
+    async def stop(self):
+        """Cancel the writer task and wait for it to finish."""
+        self.closed = True
+        self.wakeup.set()
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+            await asyncio.gather(self.writer_task, return_exceptions=True)
@@ -0,0 +1,63 @@
+"""Maps client command names to their handlers.
+
+A handler is a coroutine function called as `handler(server, client_id, data)`
+for every message whose "command" matches. The built-in commands are methods
+of WebSocketServer registered with the same decorator, so other modules can
+add or replace commands without editing the server:
+
+    from command_registry import commands
+
+    @commands.command("ping", target_id=str)
+    async def ping(server, client_id, data):
+        server.deliver(data["target_id"], '{"command":"ping"}')
+
+Keyword arguments name the fields a message must carry and their accepted
+type(s); messages that fail the check are rejected before the handler runs.
+"""
+
+
+class CommandError(ValueError):
+    """A message does not match its command's required fields."""
+
+
+class Command:
+    def __init__(self, name, handler, fields):
+        self.name = name
+        self.handler = handler
+        self.fields = fields  # Field name -> accepted type or tuple of types
+
+    def validate(self, data):
+        for field, types in self.fields.items():
+            value = data.get(field)
+            if value is None:
+                raise CommandError(f"missing '{field}'")
+            if not isinstance(value, types):
+                raise CommandError(f"'{field}' has the wrong type ({type(value).__name__})")
+
+
+class CommandRegistry:
+    def __init__(self):
+        self.commands = {}
+
+    def register(self, name, handler, **fields):
+        """Register `handler` for `name`, replacing any previous handler."""
+        self.commands[name] = Command(name, handler, fields)
+        return handler
+
+    def command(self, name, **fields):
+        """Decorator form of `register`."""
+        def decorator(handler):
+            return self.register(name, handler, **fields)
+        return decorator
+
+    def unregister(self, name):
+        self.commands.pop(name, None)
+
+    def get(self, name):
+        """Return the Command for `name`, or None (also for non-string names)."""
+        if not isinstance(name, str):
+            return None
+        return self.commands.get(name)
+
+
+commands = CommandRegistry()  # Used by every WebSocketServer unless it is given its own registry
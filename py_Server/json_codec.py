@@ -0,0 +1,42 @@
+"""JSON encoding and decoding with the fastest available backend.
+
+Uses orjson, then ujson, when installed and falls back to the standard
+library. `dumps` always returns a str, so encoded messages are still sent
+as WebSocket text frames.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(text):
+        return orjson.loads(text)
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+elif ujson is not None:
+    BACKEND = "ujson"
+
+    def loads(text):
+        return ujson.loads(text)
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False)
+
+else:
+    BACKEND = "json"
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":"))
@@ -0,0 +1,379 @@
+"""Load generator and latency benchmark for WebSocketServer.
+
+Simulates ESP32 producers and Unity consumers on localhost using the real
+protocol (REQUEST_ID handshake, start_stream/stream_data, subscribe_stream,
+request_stream_data polling and broadcasts), then reports end-to-end latency
+percentiles, message rates and server CPU/RSS. Run it from the py_Server folder:
+
+    python loadgen.py --producers 50 --rate 50 --subscribers 500 --pollers 100 --duration 20 --output run.json
+    python loadgen.py ... --compare run.json   # exits with status 1 on regression
+
+By default a headless server is started for the run (`--workers` shards it);
+pass `--url` to load an already running server instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import websockets
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class Stats:
+    """Latency samples and message counters for one client role."""
+
+    def __init__(self):
+        self.latencies = []
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        return {
+            "sent": self.sent,
+            "received": self.received,
+            "errors": self.errors,
+            "sent_per_s": self.sent / duration,
+            "received_per_s": self.received / duration,
+            "latency_ms": {
+                "p50": percentile(latencies, 0.50),
+                "p99": percentile(latencies, 0.99),
+                "p999": percentile(latencies, 0.999),
+                "max": latencies[-1] * 1000 if latencies else None,
+            },
+        }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index] * 1000
+
+
+class ServerProbe:
+    """Samples CPU time and RSS of the server process (and its workers)."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.start_cpu = self.cpu_seconds()
+        self.peak_rss = 0
+
+    def processes(self):
+        if psutil is None:
+            return []
+        try:
+            parent = psutil.Process(self.pid)
+            return [parent] + parent.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def cpu_seconds(self):
+        if psutil is not None:
+            total = 0.0
+            for process in self.processes():
+                try:
+                    times = process.cpu_times()
+                    total += times.user + times.system
+                except psutil.NoSuchProcess:
+                    pass
+            return total
+        # Without psutil, fall back to /proc on Linux (main process only)
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def rss_bytes(self):
+        if psutil is not None:
+            total = 0
+            for process in self.processes():
+                try:
+                    total += process.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            return total
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def sample(self):
+        rss = self.rss_bytes()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def summary(self, duration):
+        end_cpu = self.cpu_seconds()
+        cpu = None
+        if end_cpu is not None and self.start_cpu is not None:
+            cpu = (end_cpu - self.start_cpu) / duration * 100
+        return {"cpu_percent": cpu, "peak_rss_mb": self.peak_rss / 2**20 if self.peak_rss else None}
+
+
+# Bounds concurrent handshakes so thousands of clients don't all connect at once
+connect_limit = None
+
+
+async def connect(url, client_id):
+    """Open a connection and answer the server's REQUEST_ID handshake."""
+    async with connect_limit:
+        websocket = await websockets.connect(url, max_queue=None)
+        await websocket.recv()
+        await websocket.send(json.dumps({"command": "client_id", "client_id": client_id}))
+    return websocket
+
+
+async def producer(url, index, rate, stop, stats, recording):
+    """ESP32-like producer: stream_data at a fixed rate, value is the send time."""
+    stream_name = f"loadStream{index}"
+    websocket = await connect(url, f"producer{index}")
+    await websocket.send(json.dumps({"command": "start_stream", "stream_name": stream_name}))
+    interval = 1.0 / rate
+    next_send = time.perf_counter()
+    try:
+        while not stop.is_set():
+            await websocket.send(json.dumps({
+                "command": "stream_data",
+                "stream_name": stream_name,
+                "client_id": f"producer{index}",
+                "data": time.time()
+            }))
+            if recording.is_set():
+                stats.sent += 1
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+    finally:
+        await websocket.close()
+
+
+async def subscriber(url, index, stream_name, stop, stats, recording):
+    """Unity-like consumer that subscribes and measures producer-to-subscriber latency."""
+    websocket = await connect(url, f"subscriber{index}")
+    await websocket.send(json.dumps({"command": "subscribe_stream", "stream_name": stream_name}))
+    try:
+        while not stop.is_set():
+            try:
+                message = await asyncio.wait_for(websocket.recv(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            data = json.loads(message)
+            if data.get("command") == "stream_data" and recording.is_set():
+                stats.received += 1
+                stats.latencies.append(time.time() - float(data["data"]))
+    finally:
+        await websocket.close()
+
+
+async def poller(url, index, stream_name, rate, stop, stats, recording):
+    """Legacy consumer polling with request_stream_data; measures round-trip time."""
+    websocket = await connect(url, f"poller{index}")
+    interval = 1.0 / rate
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            await websocket.send(json.dumps({"command": "request_stream_data", "stream_name": stream_name}))
+            try:
+                await asyncio.wait_for(websocket.recv(), 5)
+            except asyncio.TimeoutError:
+                stats.errors += 1
+                continue
+            if recording.is_set():
+                stats.sent += 1
+                stats.received += 1
+                stats.latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+    finally:
+        await websocket.close()
+
+
+async def broadcaster(url, index, rate, stop, stats, recording):
+    websocket = await connect(url, f"broadcaster{index}")
+    interval = 1.0 / rate
+    try:
+        while not stop.is_set():
+            await websocket.send(json.dumps({"command": "broadcast", "data": {"sent": time.time()}}))
+            if recording.is_set():
+                stats.sent += 1
+            await asyncio.sleep(interval)
+    finally:
+        await websocket.close()
+
+
+async def broadcast_listener(websocket, stop, stats, recording):
+    """Measures broadcast latency on a connection that otherwise sits idle."""
+    try:
+        while not stop.is_set():
+            try:
+                message = await asyncio.wait_for(websocket.recv(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            data = json.loads(message)
+            if data.get("command") == "broadcast" and recording.is_set():
+                stats.received += 1
+                stats.latencies.append(time.time() - float(data["data"]["sent"]))
+    finally:
+        await websocket.close()
+
+
+async def run_load(args, probe):
+    global connect_limit
+    connect_limit = asyncio.Semaphore(args.connect_concurrency)
+    stop = asyncio.Event()
+    recording = asyncio.Event()
+    stats = {role: Stats() for role in ("producer", "subscriber", "poller", "broadcast")}
+    tasks = []
+    url = args.url
+
+    for i in range(args.producers):
+        tasks.append(asyncio.ensure_future(producer(url, i, args.rate, stop, stats["producer"], recording)))
+    await asyncio.sleep(0.5)  # Let the streams exist before consumers attach
+
+    streams = max(1, args.producers)
+    for i in range(args.subscribers):
+        stream_name = f"loadStream{i % streams}"
+        tasks.append(asyncio.ensure_future(subscriber(url, i, stream_name, stop, stats["subscriber"], recording)))
+    for i in range(args.pollers):
+        stream_name = f"loadStream{i % streams}"
+        tasks.append(asyncio.ensure_future(poller(url, i, stream_name, args.poll_rate, stop, stats["poller"], recording)))
+    if args.broadcasters:
+        for i in range(args.broadcast_listeners):
+            websocket = await connect(url, f"listener{i}")
+            tasks.append(asyncio.ensure_future(broadcast_listener(websocket, stop, stats["broadcast"], recording)))
+        for i in range(args.broadcasters):
+            tasks.append(asyncio.ensure_future(broadcaster(url, i, args.broadcast_rate, stop, stats["broadcast"], recording)))
+
+    await asyncio.sleep(args.warmup)
+    recording.set()
+    started = time.perf_counter()
+    if probe is not None:
+        probe.start_cpu = probe.cpu_seconds()
+    while time.perf_counter() - started < args.duration:
+        await asyncio.sleep(0.5)
+        if probe is not None:
+            probe.sample()
+    duration = time.perf_counter() - started
+    server_summary = probe.summary(duration) if probe is not None else None
+    recording.clear()
+    stop.set()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    failures = [r for r in results if isinstance(r, Exception)]
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "duration_s": duration,
+        "failed_clients": len(failures),
+        "roles": {role: s.summary(duration) for role, s in stats.items() if s.sent or s.received},
+        "server": server_summary,
+    }
+
+
+def start_server(args):
+    command = [sys.executable, "main.py", "--headless", "--port", str(args.port), "--workers", str(args.workers)]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.5 if args.workers > 1 else 1.0)
+    if process.poll() is not None:
+        raise SystemExit(f"Server exited with code {process.returncode}")
+    return process
+
+
+def compare(current, baseline, tolerance):
+    """Print per-role changes against a baseline; return True if any p99 latency regressed."""
+    regressed = False
+    for role, summary in current["roles"].items():
+        before = baseline.get("roles", {}).get(role)
+        if not before:
+            continue
+        old = before["latency_ms"]["p99"]
+        new = summary["latency_ms"]["p99"]
+        if old and new:
+            change = (new - old) / old
+            flag = "REGRESSION" if change > tolerance else ""
+            regressed = regressed or change > tolerance
+            print(f"{role:>10} p99 {old:8.2f} ms -> {new:8.2f} ms ({change:+.0%}) {flag}")
+        old_rate = before["received_per_s"]
+        new_rate = summary["received_per_s"]
+        if old_rate:
+            print(f"{role:>10} received/s {old_rate:10.0f} -> {new_rate:10.0f} ({(new_rate - old_rate) / old_rate:+.0%})")
+    return regressed
+
+
+def print_report(report):
+    print(f"Duration {report['duration_s']:.1f} s, failed clients: {report['failed_clients']}")
+    for role, summary in report["roles"].items():
+        latency = summary["latency_ms"]
+        values = " ".join(f"{k}={v:.2f}ms" if v is not None else f"{k}=n/a" for k, v in latency.items())
+        print(f"{role:>10}: sent {summary['sent_per_s']:9.0f}/s  received {summary['received_per_s']:9.0f}/s  {values}")
+    server = report["server"]
+    if server:
+        cpu = f"{server['cpu_percent']:.0f}%" if server["cpu_percent"] is not None else "n/a"
+        rss = f"{server['peak_rss_mb']:.1f} MB" if server["peak_rss_mb"] else "n/a"
+        print(f"    server: CPU {cpu}  peak RSS {rss}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="load an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=18080, help="port for the server started by the benchmark")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for the started server")
+    parser.add_argument("--producers", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=50, help="stream_data messages per second per producer")
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument("--pollers", type=int, default=0)
+    parser.add_argument("--poll-rate", type=float, default=30, help="request_stream_data per second per poller")
+    parser.add_argument("--broadcasters", type=int, default=0)
+    parser.add_argument("--broadcast-rate", type=float, default=5)
+    parser.add_argument("--broadcast-listeners", type=int, default=10,
+                        help="idle clients measuring broadcast latency (every client receives broadcasts)")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative p99 increase before failing")
+    args = parser.parse_args()
+
+    process = None
+    probe = None
+    if args.url is None:
+        process = start_server(args)
+        args.url = f"ws://127.0.0.1:{args.port}"
+        probe = ServerProbe(process.pid)
+
+    try:
+        report = asyncio.run(run_load(args, probe))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
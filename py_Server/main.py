@@ -1,7 +1,76 @@
-from tkinter import Tk
-from server_app import ServerApp
+import argparse
+import logging
+import signal
+
+from client_connection import DROP_OLDEST, OVERFLOW_POLICIES
+
+
+def run_headless(port, metrics_port=None, record_directory=None, options=None):
+    """Run the WebSocket server in the foreground without a GUI."""
+    from websocket_server import WebSocketServer
+
+    server = WebSocketServer()
+    server.port = port
+    server.metrics_port = metrics_port
+    server.record_directory = record_directory
+    for name, value in (options or {}).items():
+        setattr(server, name, value)
+
+    def request_stop(signum, frame):
+        logging.info("Stop requested, shutting down...")
+        server.stop()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    server.start()
+
+
+def run_gui():
+    from tkinter import Tk
+    from server_app import ServerApp
 
-if __name__ == "__main__":
     root = Tk()
     app = ServerApp(root)
     root.mainloop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket server for Unity VR and ESP32 clients")
+    parser.add_argument("--headless", action="store_true", help="run without the Tkinter GUI")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on in headless mode")
+    parser.add_argument("--workers", type=int, default=1, help="number of server processes sharing the port (headless only)")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus /metrics on localhost at this port "
+                                                        "(worker N of a sharded server uses port + N)")
+    parser.add_argument("--record", metavar="DIR", help="record every stream's samples into DIR (headless, single worker)")
+    parser.add_argument("--send-queue-size", type=int, default=256, metavar="MESSAGES",
+                        help="maximum number of outbound messages queued per client")
+    parser.add_argument("--overflow-policy", choices=OVERFLOW_POLICIES, default=DROP_OLDEST,
+                        help="what to do when a client's send queue is full")
+    parser.add_argument("--heartbeat", type=float, default=15, metavar="SECONDS",
+                        help="ping clients that have been quiet this long (0 disables)")
+    parser.add_argument("--idle-timeout", type=float, default=60, metavar="SECONDS",
+                        help="disconnect clients that have been quiet this long (0 disables)")
+    parser.add_argument("--session-ttl", type=float, default=300, metavar="SECONDS",
+                        help="how long a disconnected client can resume its session")
+    args = parser.parse_args()
+    # WebSocketServer attributes set from the command line
+    options = {
+        "send_queue_size": args.send_queue_size,
+        "overflow_policy": args.overflow_policy,
+        "heartbeat_interval": args.heartbeat or None,
+        "idle_timeout": args.idle_timeout or None,
+        "session_ttl": args.session_ttl,
+    }
+
+    if args.send_queue_size < 1:
+        parser.error("--send-queue-size must be at least 1")
+    if args.record and (not args.headless or args.workers > 1):
+        parser.error("--record needs --headless and a single worker")
+
+    if args.headless and args.workers > 1:
+        from sharded_server import run_sharded
+        run_sharded(args.port, args.workers, args.metrics_port, options)
+    elif args.headless:
+        run_headless(args.port, args.metrics_port, args.record, options)
+    else:
+        run_gui()
@@ -0,0 +1,251 @@
+"""Low-overhead server metrics with a Prometheus text endpoint.
+
+Counters and histograms are plain dicts keyed by one optional label value,
+so recording a sample is a dict lookup and an addition. Gauges are computed
+from callbacks only when the metrics are read.
+
+`MetricsHTTPServer` serves:
+
+    GET /metrics               Prometheus text format
+    GET /profile?seconds=N     collapsed stacks of the event loop thread
+                               (flamegraph.pl / speedscope input)
+"""
+import asyncio
+import bisect
+import collections
+import logging
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+# Seconds, from 10 us to 1 s
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def format_labels(label_name, label_value, extra=""):
+    labels = []
+    if label_name is not None:
+        escaped = str(label_value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        labels.append(f'{label_name}="{escaped}"')
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.values = collections.defaultdict(int)
+
+    def inc(self, label_value="", amount=1):
+        self.values[label_value] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.label, label_value)} {value}")
+        return lines
+
+    def snapshot(self):
+        return dict(self.values) if self.label is not None else self.values.get("", 0)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        self.counts = {}  # Label value -> per-bucket counts, the last one is +Inf
+        self.sums = collections.defaultdict(float)
+
+    def observe(self, value, label_value=""):
+        counts = self.counts.get(label_value)
+        if counts is None:
+            counts = self.counts[label_value] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[label_value] += value
+
+    def quantile(self, counts, q):
+        """Estimate a quantile as the upper bound of the bucket that contains it.
+
+        Returns None if it falls in the +Inf bucket, since JSON has no infinity.
+        """
+        target = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = format_labels(self.label, label_value, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label, label_value)} {self.sums[label_value]}")
+            lines.append(f"{self.name}_count{format_labels(self.label, label_value)} {cumulative}")
+        return lines
+
+    def snapshot(self):
+        result = {}
+        for label_value, counts in self.counts.items():
+            count = sum(counts)
+            result[label_value] = {
+                "count": count,
+                "mean": self.sums[label_value] / count,
+                "p50": self.quantile(counts, 0.5),
+                "p99": self.quantile(counts, 0.99),
+            }
+        return result if self.label is not None else result.get("", {"count": 0})
+
+
+class Gauge:
+    """A value read from `callback` at scrape time: a number, or a dict of label value -> number."""
+
+    def __init__(self, name, help_text, callback, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        if self.label is None:
+            lines.append(f"{self.name} {value}")
+        else:
+            for label_value, v in value.items():
+                lines.append(f"{self.name}{format_labels(self.label, label_value)} {v}")
+        return lines
+
+    def snapshot(self):
+        return self.callback()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.started = time.time()
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, label=None):
+        return self.add(Counter(name, help_text, label))
+
+    def histogram(self, name, help_text, label=None, buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help_text, label, buckets))
+
+    def gauge(self, name, help_text, callback, label=None):
+        return self.add(Gauge(name, help_text, callback, label))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict."""
+        stats = {name: metric.snapshot() for name, metric in self.metrics.items()}
+        stats["uptime_seconds"] = time.time() - self.started
+        return stats
+
+
+def sample_stacks(thread_id, seconds, interval=0.005):
+    """Sample a thread's stack every `interval` seconds; returns collapsed stack lines.
+
+    Runs in the calling thread, so call it from an executor to profile the
+    event loop thread while it keeps running.
+    """
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stacks[";".join(reversed(names))] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+
+class MetricsHTTPServer:
+    """Minimal HTTP server exposing /metrics and /profile on the event loop."""
+
+    def __init__(self, registry, host="127.0.0.1", port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+        self.loop_thread = None
+        self.profiling = False
+
+    async def start(self):
+        self.loop_thread = threading.get_ident()
+        self.server = await asyncio.start_server(self.handle_request, self.host, self.port)
+        logging.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def handle_request(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # Headers are not needed
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                await self.respond(writer, 405, "Method not allowed\n")
+                return
+            url = urlsplit(parts[1])
+            if url.path == "/metrics":
+                await self.respond(writer, 200, self.registry.render(), "text/plain; version=0.0.4")
+            elif url.path == "/profile":
+                try:
+                    seconds = float(parse_qs(url.query).get("seconds", ["5"])[0])
+                except ValueError:
+                    await self.respond(writer, 400, "Invalid seconds\n")
+                    return
+                await self.respond(writer, *await self.profile(min(seconds, 60)))
+            else:
+                await self.respond(writer, 404, "Not found\n")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def profile(self, seconds):
+        if self.profiling:
+            return 409, "A profile is already running\n"
+        self.profiling = True
+        try:
+            logging.info(f"Profiling event loop for {seconds} s")
+            loop = asyncio.get_running_loop()
+            return 200, await loop.run_in_executor(None, sample_stacks, self.loop_thread, seconds)
+        finally:
+            self.profiling = False
+
+    async def respond(self, writer, status, body, content_type="text/plain"):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict"}
+        body = body.encode()
+        writer.write(f"HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
@@ -0,0 +1,102 @@
+"""Per-stream rules for which updates are pushed to subscribers.
+
+Every update is still stored as the stream's current value and in its
+history; a policy only decides whether subscribers are sent it. Updates are
+compared with the value last sent:
+
+- `on_change`: skip values equal to the last one sent.
+- `deadband`: skip numbers within this absolute distance of the last one sent.
+- `relative_deadband`: skip numbers within this fraction of the last one sent.
+- `keyframe_interval`: send at least every this many seconds, as a full value
+  even to subscribers that receive deltas.
+
+Batches of samples are always sent.
+"""
+import math
+from numbers import Real
+
+from subscriptions import as_flag
+
+OPTIONS = ("on_change", "deadband", "relative_deadband", "keyframe_interval")
+
+# Results of PublishPolicy.check
+SUPPRESS = 0
+SEND = 1
+KEYFRAME = 2
+
+
+def as_number(value):
+    """Return a value as a float if it is a number or numeric string, else None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, Real):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+        return number if math.isfinite(number) else None
+    return None
+
+
+class PublishPolicy:
+    def __init__(self, on_change=False, deadband=None, relative_deadband=None, keyframe_interval=None):
+        for name, value in (("deadband", deadband), ("relative_deadband", relative_deadband),
+                            ("keyframe_interval", keyframe_interval)):
+            if value is not None and value < 0:
+                raise ValueError(f"{name} must not be negative")
+        self.on_change = on_change
+        self.deadband = deadband or 0.0
+        self.relative_deadband = relative_deadband or 0.0
+        self.keyframe_interval = keyframe_interval
+        self.last_keyframe = None
+
+    @classmethod
+    def from_options(cls, options):
+        """Build a policy from a dict of OPTIONS; returns None if it sets none of them."""
+        def number(name):
+            value = options.get(name)
+            return None if value is None else float(value)
+        if not options:
+            return None
+        on_change = as_flag(options.get("on_change"))
+        if not on_change and not any(number(name) for name in OPTIONS[1:]):
+            return None
+        return cls(
+            on_change=on_change,
+            deadband=number("deadband"),
+            relative_deadband=number("relative_deadband"),
+            keyframe_interval=number("keyframe_interval"),
+        )
+
+    def to_options(self):
+        return {
+            "on_change": self.on_change,
+            "deadband": self.deadband,
+            "relative_deadband": self.relative_deadband,
+            "keyframe_interval": self.keyframe_interval,
+        }
+
+    def check(self, previous, value, now):
+        """Classify an update as SUPPRESS, SEND or KEYFRAME; `previous` is the value last sent."""
+        if previous is None or (self.keyframe_interval is not None and
+                                (self.last_keyframe is None or now - self.last_keyframe >= self.keyframe_interval)):
+            self.last_keyframe = now
+            return KEYFRAME
+        if self.on_change and value == previous:
+            return SUPPRESS
+        if self.deadband or self.relative_deadband:
+            number = as_number(value)
+            last = as_number(previous)
+            if number is not None and last is not None:
+                if abs(number - last) <= max(self.deadband, self.relative_deadband * abs(last)):
+                    return SUPPRESS
+        return SEND
+
+
+def compute_delta(previous, value):
+    """Return (changed fields, removed keys) between two dicts."""
+    changed = {key: v for key, v in value.items() if key not in previous or previous[key] != v}
+    removed = [key for key in previous if key not in value]
+    return changed, removed
@@ -0,0 +1,164 @@
+"""Local publish/subscribe bus that connects the worker processes of a sharded server.
+
+The hub listens on a Unix socket. Every worker connects to it, subscribes to
+the topics it cares about and publishes messages to topics. The hub routes
+each published frame to the other subscribers of that topic without decoding
+the payload.
+
+Frame layout (little-endian):
+
+    offset  size  field
+    0       4     payload length (uint32)
+    4       1     op (OP_SUBSCRIBE, OP_UNSUBSCRIBE or OP_PUBLISH)
+    5       2     topic length (uint16)
+    7       ...   topic (UTF-8), then payload
+
+Writes are bounded like a client's send queue: the hub disconnects a worker
+whose unsent frames exceed `max_buffer` bytes (the worker then restarts and
+resyncs), and a worker drops its own publishes while the hub is that far
+behind.
+"""
+import asyncio
+import logging
+import struct
+
+HEADER = struct.Struct("<IBH")
+OP_SUBSCRIBE = 1
+OP_UNSUBSCRIBE = 2
+OP_PUBLISH = 3
+MAX_BUFFER = 8 * 1024 * 1024  # Bytes of unsent frames allowed per bus connection
+
+
+def encode_frame(op, topic, payload=b""):
+    topic = topic.encode()
+    return HEADER.pack(len(payload), op, len(topic)) + topic + payload
+
+
+async def read_frame(reader):
+    """Read one frame; returns (op, topic, payload, raw frame bytes)."""
+    header = await reader.readexactly(HEADER.size)
+    payload_length, op, topic_length = HEADER.unpack(header)
+    body = await reader.readexactly(topic_length + payload_length)
+    return op, body[:topic_length].decode(), body[topic_length:], header + body
+
+
+class BusHub:
+    """Routes frames between connected workers by topic."""
+
+    def __init__(self, path, max_buffer=MAX_BUFFER):
+        self.path = path
+        self.server = None
+        self.max_buffer = max_buffer
+        self.topics = {}  # Topic -> set of subscribed worker writers
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.handle_worker, path=self.path)
+        logging.info(f"Routing bus listening on {self.path}")
+
+    async def handle_worker(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                op, topic, payload, frame = await read_frame(reader)
+                if op == OP_PUBLISH:
+                    for subscriber in self.topics.get(topic, ()):
+                        if subscriber is not writer and not subscriber.is_closing():
+                            self.route(subscriber, frame)
+                elif op == OP_SUBSCRIBE:
+                    self.topics.setdefault(topic, set()).add(writer)
+                    subscribed.add(topic)
+                elif op == OP_UNSUBSCRIBE:
+                    self.unsubscribe(topic, writer)
+                    subscribed.discard(topic)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for topic in subscribed:
+                self.unsubscribe(topic, writer)
+            writer.close()
+
+    def route(self, subscriber, frame):
+        if subscriber.transport.get_write_buffer_size() > self.max_buffer:
+            # The worker stopped reading; cut it off rather than buffer without limit
+            logging.warning("Disconnecting a worker that is not reading from the routing bus")
+            subscriber.transport.abort()
+            return
+        subscriber.write(frame)
+
+    def unsubscribe(self, topic, writer):
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.topics[topic]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+class BusClient:
+    """A worker's connection to the hub.
+
+    `handler(topic, payload)` is awaited for every frame the hub routes to
+    this worker; `on_lost()` is called if the connection to the hub drops.
+    """
+
+    def __init__(self, path, handler, on_lost=None, max_buffer=MAX_BUFFER):
+        self.path = path
+        self.handler = handler
+        self.on_lost = on_lost
+        self.max_buffer = max_buffer
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.dropped = 0  # Publishes discarded because the hub was not keeping up
+
+    async def connect(self, attempts=50, delay=0.1):
+        # The hub may still be starting when a worker comes up
+        for attempt in range(attempts):
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(delay)
+        self.reader_task = asyncio.ensure_future(self.read_loop())
+
+    async def read_loop(self):
+        try:
+            while True:
+                op, topic, payload, _ = await read_frame(self.reader)
+                try:
+                    await self.handler(topic, payload)
+                except Exception as e:
+                    logging.error(f"Error handling bus message on '{topic}': {e}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logging.warning("Routing bus connection lost")
+            if self.on_lost is not None:
+                self.on_lost()
+        except asyncio.CancelledError:
+            pass
+
+    def subscribe(self, topic):
+        self.writer.write(encode_frame(OP_SUBSCRIBE, topic))
+
+    def unsubscribe(self, topic):
+        self.writer.write(encode_frame(OP_UNSUBSCRIBE, topic))
+
+    def publish(self, topic, payload):
+        if self.writer.transport.get_write_buffer_size() > self.max_buffer:
+            if not self.dropped:
+                logging.warning("Routing bus is not keeping up, dropping published messages")
+            self.dropped += 1
+            return
+        self.writer.write(encode_frame(OP_PUBLISH, topic, payload))
+
+    async def close(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            await asyncio.gather(self.reader_task, return_exceptions=True)
+        if self.writer is not None:
+            self.writer.close()
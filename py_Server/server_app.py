@@ -3,6 +3,8 @@ from tkinter import scrolledtext
 from threading import Thread
 import asyncio
 import logging
+import time
+from server_events import QueueEvents
 from websocket_server import WebSocketServer  # Import the WebSocketServer class
 
 class ServerApp:
@@ -11,8 +13,37 @@ class ServerApp:
         self.root.title("WebSocket Server")
         
 
-        # Create an instance of WebSocketServer and pass `self` (ServerApp instance) to it
-        self.websocket_server = WebSocketServer(self)
+        # The server runs on its own thread and reports events through a queue,
+        # which the Tk loop drains in process_events
+        self.events = QueueEvents()
+        self.websocket_server = WebSocketServer(self.events)
+        self.event_handlers = {
+            "log_message": self.log_message,
+            "client_connected": self.add_client,
+            "client_disconnected": self.remove_client,
+            "streams_changed": self.set_stream_names,
+            "stream_updated": self.add_stream_samples,
+            "server_started": self.update_IP_config,
+            "server_stopped": lambda: None,
+        }
+        self.event_budget = 0.015  # Seconds of event handling per Tk tick, so the window stays responsive
+        self.event_batch = 200  # Events taken from the queue at a time
+
+        # Log lines are buffered and written once per tick; beyond log_rate_limit
+        # lines per second they are counted and summarized instead of shown
+        self.log_max_lines = 1000
+        self.log_rate_limit = 50
+        self.log_pending = []
+        self.log_window_start = time.monotonic()
+        self.log_window_count = 0
+        self.log_suppressed = 0
+
+        # Client IDs in the order they appear in the client list, for incremental updates
+        self.client_lines = []
+        self.clients_changed = False
+        # Open streams as last reported by the server; the GUI never reads server state directly
+        self.stream_names = []
+        self.streams_changed = False
 
         # Main frame that holds all the components
         self.main_frame = tk.Frame(root)
@@ -31,7 +62,7 @@ class ServerApp:
         # Dropdown to select stream
         self.select_streams_dropdown = tk.StringVar(self.top_frame)
         self.select_streams_dropdown.set("Select Stream")  # Default value
-        self.select_streams_menu = tk.OptionMenu(self.top_frame, self.select_streams_dropdown, "Select Stream", *self.websocket_server.streams.keys())
+        self.select_streams_menu = tk.OptionMenu(self.top_frame, self.select_streams_dropdown, "Select Stream")
         self.select_streams_menu.pack(side=tk.LEFT, padx=5)
         
         # IP and Port label
@@ -55,7 +86,7 @@ class ServerApp:
 
         self.select_clients_dropdown = tk.StringVar(self.select_client_frame)
         self.select_clients_dropdown.set("Select Client")  # Default value
-        self.select_clients_menu = tk.OptionMenu(self.select_client_frame, self.select_clients_dropdown, "Select Client", *self.websocket_server.clients.keys())
+        self.select_clients_menu = tk.OptionMenu(self.select_client_frame, self.select_clients_dropdown, "Select Client")
         self.select_clients_menu.pack(side=tk.LEFT, padx=5)
 
         self.client_message_entry = tk.Entry(self.select_client_frame)
@@ -105,8 +136,13 @@ class ServerApp:
         self.resend_button = tk.Button(self.bottom_frame, text="Disable Resend", command=self.toggle_resend)
         self.resend_button.pack(side=tk.RIGHT, padx=10)
         
-        # update stream log 
-        self.update_log_loop()
+        # Stream log state: which stream is shown and the lines waiting to be written
+        self.stream_log_stream = None
+        self.stream_log_lines = 20
+        self.stream_log_pending = []
+        self.select_streams_dropdown.trace_add("write", self.on_stream_selected)
+
+        self.process_events()
 
     def start_server(self):
         self.server_thread = Thread(target=self.websocket_server.start)
@@ -120,40 +156,80 @@ class ServerApp:
         self.server_info_label.config(text=f"IP: {host} Port: {port}")
 
     def stop_server(self):
+        # stop() only signals the server thread; wait for it without blocking the Tk loop
         self.websocket_server.stop()
-        self.server_thread.join()
+        self.stop_button.config(state=tk.DISABLED)
+        self.log_message("Server stopping...")
+        self.wait_for_server_thread()
+
+    def wait_for_server_thread(self):
+        if self.server_thread.is_alive():
+            self.root.after(50, self.wait_for_server_thread)
+            return
         self.log_message("Server stopped.")
         self.start_button.config(state=tk.NORMAL)
-        self.stop_button.config(state=tk.DISABLED)
         self.server_info_label.config(text="")  # Clear IP and Port info when the server stops
 
     def log_message(self, message):
+        """Queue a line for the server log; it is written on the next flush_log."""
+        now = time.monotonic()
+        if now - self.log_window_start >= 1.0:
+            self.note_suppressed()
+            self.log_window_start = now
+            self.log_window_count = 0
+        self.log_window_count += 1
+        if self.log_window_count > self.log_rate_limit:
+            self.log_suppressed += 1
+            return
+        self.log_pending.append(message)
+
+    def note_suppressed(self):
+        if self.log_suppressed:
+            self.log_pending.append(f"... {self.log_suppressed} messages suppressed")
+            self.log_suppressed = 0
+
+    def flush_log(self):
+        """Write buffered log lines in one insert and trim the log to log_max_lines."""
+        if time.monotonic() - self.log_window_start >= 1.0:
+            self.note_suppressed()
+        if not self.log_pending:
+            return
         self.log_text.config(state='normal')
-        self.log_text.insert(tk.END, message + '\n')
+        self.log_text.insert(tk.END, "\n".join(self.log_pending) + "\n")
+        self.log_pending = []
+        num_lines = int(self.log_text.index('end-1c').split('.')[0]) - 1
+        if num_lines > self.log_max_lines:
+            self.log_text.delete('1.0', f"{num_lines - self.log_max_lines + 1}.0")
         self.log_text.config(state='disabled')
         self.log_text.yview(tk.END)
 
     def add_client(self, client_id):
+        self.client_lines.append(client_id)
         self.clients_list.config(state='normal')
         self.clients_list.insert(tk.END, f"Client ID {client_id}\n")
         self.clients_list.config(state='disabled')
         self.clients_list.yview(tk.END)
-        self.refresh_client_dropdown()
+        self.clients_changed = True
 
     def remove_client(self, client_id):
+        if client_id not in self.client_lines:
+            return
+        # Delete only the line for this client
+        line = self.client_lines.index(client_id) + 1
+        del self.client_lines[line - 1]
         self.clients_list.config(state='normal')
-        clients = self.clients_list.get("1.0", tk.END).splitlines()
-        self.clients_list.delete("1.0", tk.END)
-        for client in clients:
-            if client != f"Client ID {client_id}":
-                self.clients_list.insert(tk.END, client + "\n")
+        self.clients_list.delete(f"{line}.0", f"{line + 1}.0")
         self.clients_list.config(state='disabled')
-        self.refresh_client_dropdown()
+        self.clients_changed = True
+
+    def set_stream_names(self, stream_names):
+        self.stream_names = stream_names
+        self.streams_changed = True
 
     def refresh_client_dropdown(self):
         menu = self.select_clients_menu["menu"]
         menu.delete(0, "end")
-        for client_id in self.websocket_server.clients.keys():
+        for client_id in self.client_lines:
             menu.add_command(label=client_id, command=lambda value=client_id: self.select_clients_dropdown.set(value))
 
     def broadcast_message(self, event=None):
@@ -171,56 +247,98 @@ class ServerApp:
             self.log_message(f"Sent to {selected_client}: {message}")
             self.client_message_entry.delete(0, tk.END)
     
-    def update_log_loop(self):
-        """This function will run periodically to update the logs."""
-        # Check the selected stream and refresh the log display
+    def process_events(self):
+        """Apply events queued by the server thread to the widgets.
+
+        Events are handled in batches until the frame budget is spent; the
+        rest wait for the next tick, which comes sooner while a backlog remains.
+        Widgets that summarize many events (log, dropdowns) are redrawn once per tick.
+        """
+        deadline = time.monotonic() + self.event_budget
+        while time.monotonic() < deadline:
+            events = self.events.drain(self.event_batch)
+            if not events:
+                break
+            for name, args in events:
+                self.event_handlers[name](*args)
+
+        self.flush_log()
+        self.flush_stream_log()
+        if self.clients_changed:
+            self.clients_changed = False
+            self.refresh_client_dropdown()
+        if self.streams_changed:
+            self.streams_changed = False
+            self.refresh_stream_dropdown()
+
+        backlog = not self.events.queue.empty()
+        self.root.after(10 if backlog else 50, self.process_events)
+
+    def on_stream_selected(self, *args):
+        """Show the selected stream's recent samples, then its live updates."""
         selected_stream = self.select_streams_dropdown.get()
-        self.update_stream_log(selected_stream)
-
-        # Schedule this function to run again after 1 second (1000 ms)
-        self.root.after(100, self.update_log_loop)
-        
-    def update_stream_log(self, selected_stream):
-        max_lines = 20
-        if selected_stream != "Select Stream" and selected_stream in self.websocket_server.streams:
-            current_data = self.websocket_server.streams[selected_stream]
-            self.stream_data_display.config(state='normal')
-            
-            # Insert the new log entry
-            self.stream_data_display.insert(tk.END, f"{current_data}\n")
-            
-            # Check the number of lines in the log
-            num_lines = int(self.stream_data_display.index('end-1c').split('.')[0])
-            
-            # If the number of lines exceeds max_lines, delete the oldest ones
-            if num_lines > max_lines:
-                self.stream_data_display.delete('1.0', '2.0')
-            
-            self.stream_data_display.config(state='disabled')
-            self.stream_data_display.yview(tk.END)
+        if selected_stream == self.stream_log_stream:
+            return
+        self.stream_log_stream = selected_stream
+        self.stream_log_pending = []
+        self.stream_data_display.config(state='normal')
+        self.stream_data_display.delete('1.0', tk.END)
+        self.stream_data_display.config(state='disabled')
+
+        stream_name = selected_stream if selected_stream in self.stream_names else None
+        loop = self.websocket_server.loop
+        if stream_name is not None and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.watch_stream, stream_name)
         else:
-            self.stream_data_display.config(state='normal')
-            # self.stream_data_display.insert(tk.END, "No valid stream selected or stream not found.\n")
-            
-            # Optional: Check and delete lines here as well, if needed
-            num_lines = int(self.stream_data_display.index('end-1c').split('.')[0])
-            if num_lines > max_lines:
-                self.stream_data_display.delete('1.0', '2.0')
-            
-            self.stream_data_display.config(state='disabled')
+            self.events.watched_stream = stream_name
+
+    def watch_stream(self, stream_name):
+        """Runs on the server thread, so the recent samples are queued ahead of any live update."""
+        self.events.watched_stream = stream_name
+        history = self.websocket_server.stream_history.get(stream_name)
+        current_data = self.websocket_server.streams.get(stream_name)
+        if history is not None and len(history):
+            self.events.stream_updated(stream_name, None, None, history.last(self.stream_log_lines))
+        elif current_data is not None:
+            # Non-numeric streams have no history; show the current value
+            self.events.stream_updated(stream_name, time.time(), current_data)
+
+    def add_stream_samples(self, stream_name, timestamp, value, samples=None):
+        if stream_name != self.stream_log_stream:
+            return  # Queued before the selection changed
+        for ts, v in samples if samples is not None else [[timestamp, value]]:
+            try:
+                text = f"{float(v):g}"
+            except (TypeError, ValueError):
+                text = f"{v}"
+            self.stream_log_pending.append(f"{time.strftime('%H:%M:%S', time.localtime(ts))} {text}")
+        del self.stream_log_pending[:-self.stream_log_lines]
+
+    def flush_stream_log(self):
+        """Write buffered stream samples in one insert, keeping the newest stream_log_lines."""
+        if not self.stream_log_pending:
+            return
+        self.stream_data_display.config(state='normal')
+        self.stream_data_display.insert(tk.END, "\n".join(self.stream_log_pending) + "\n")
+        self.stream_log_pending = []
+        num_lines = int(self.stream_data_display.index('end-1c').split('.')[0]) - 1
+        if num_lines > self.stream_log_lines:
+            self.stream_data_display.delete('1.0', f"{num_lines - self.stream_log_lines + 1}.0")
+        self.stream_data_display.config(state='disabled')
+        self.stream_data_display.yview(tk.END)
 
     def refresh_stream_dropdown(self):
-        """Refresh the dropdown menu to include all streams from the WebSocketServer."""
+        """Refresh the dropdown menu to include all open streams."""
         current_selection = self.select_streams_dropdown.get()  # Preserve the current selection
         menu = self.select_streams_menu["menu"]
         menu.delete(0, "end")  # Clear the existing menu options
 
-        # Add each stream from the WebSocketServer
-        for stream_name in self.websocket_server.streams.keys():
+        # Add each stream the server last reported
+        for stream_name in self.stream_names:
             menu.add_command(label=stream_name, command=lambda value=stream_name: self.select_streams_dropdown.set(value))
 
         # Reapply the preserved selection if it still exists
-        if current_selection in self.websocket_server.streams:
+        if current_selection in self.stream_names:
             self.select_streams_dropdown.set(current_selection)
         else:
             self.select_streams_dropdown.set("Select Stream")
@@ -0,0 +1,78 @@
+import queue
+
+
+class ServerEvents:
+    """Receives notifications from WebSocketServer.
+
+    The base class ignores every event, which is what a headless server uses.
+    Front ends override the methods they care about.
+    """
+
+    def log_message(self, message):
+        pass
+
+    def client_connected(self, client_id):
+        pass
+
+    def client_disconnected(self, client_id):
+        pass
+
+    def streams_changed(self, stream_names):
+        """A stream was opened or closed; `stream_names` lists the open streams."""
+        pass
+
+    def stream_updated(self, stream_name, timestamp, value, samples=None):
+        """A stream got a value, or a batch of [timestamp, value] samples."""
+        pass
+
+    def server_started(self, host, port):
+        pass
+
+    def server_stopped(self):
+        pass
+
+
+class QueueEvents(ServerEvents):
+    """Forwards events to a thread-safe queue as (event name, args) tuples.
+
+    The server thread only pays for a queue put; a GUI drains the queue from
+    its own thread and updates widgets there. Stream updates are only
+    forwarded for `watched_stream`, so a busy stream the GUI isn't showing
+    doesn't flood the queue.
+    """
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.watched_stream = None
+
+    def log_message(self, message):
+        self.queue.put(("log_message", (message,)))
+
+    def client_connected(self, client_id):
+        self.queue.put(("client_connected", (client_id,)))
+
+    def client_disconnected(self, client_id):
+        self.queue.put(("client_disconnected", (client_id,)))
+
+    def streams_changed(self, stream_names):
+        self.queue.put(("streams_changed", (stream_names,)))
+
+    def stream_updated(self, stream_name, timestamp, value, samples=None):
+        if stream_name == self.watched_stream:
+            self.queue.put(("stream_updated", (stream_name, timestamp, value, samples)))
+
+    def server_started(self, host, port):
+        self.queue.put(("server_started", (host, port)))
+
+    def server_stopped(self):
+        self.queue.put(("server_stopped", ()))
+
+    def drain(self, limit=None):
+        """Return queued events without blocking, at most `limit` of them."""
+        events = []
+        while limit is None or len(events) < limit:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
@@ -0,0 +1,80 @@
+"""Session tokens that let a client reconnect and carry on where it left off.
+
+A client asks for a session by adding `"session": true` to its client_id
+handshake and receives a token. After a dropped connection it answers the
+REQUEST_ID handshake with `{"command": "resume", "session": token}` and gets
+its client ID, the streams it started and its subscriptions back at once.
+A token stays valid while its client is connected and for a grace period
+(the server's `session_ttl`) after it disconnects.
+"""
+import secrets
+import time
+
+
+class Session:
+    def __init__(self, token, client_id):
+        self.token = token
+        self.client_id = client_id
+        self.streams = set()  # Streams this client started
+        self.subscriptions = []  # Subscriptions parked while the client is disconnected
+        self.expires = None  # time.monotonic() deadline while disconnected, None while connected
+
+
+class SessionStore:
+    def __init__(self):
+        self.sessions = {}  # Token -> Session
+        self.by_client = {}  # Client ID -> Session
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, client_id):
+        """Start a new session for a client, replacing any previous one."""
+        return self.adopt(secrets.token_urlsafe(16), client_id)
+
+    def adopt(self, token, client_id):
+        """Return the session for `token`, adding it if it is new (e.g. created by another worker)."""
+        session = self.sessions.get(token)
+        if session is None:
+            self.discard(self.by_client.get(client_id))
+            session = Session(token, client_id)
+            self.sessions[token] = session
+            self.by_client[client_id] = session
+        return session
+
+    def resume(self, token):
+        """Return the live session for `token`, or None if it is unknown or expired."""
+        session = self.sessions.get(token) if isinstance(token, str) else None
+        if session is None or (session.expires is not None and session.expires <= time.monotonic()):
+            return None
+        session.expires = None
+        return session
+
+    def get(self, client_id):
+        return self.by_client.get(client_id)
+
+    def release(self, client_id, ttl):
+        """Keep a disconnected client's session resumable for `ttl` seconds."""
+        session = self.by_client.get(client_id)
+        if session is not None:
+            session.expires = time.monotonic() + ttl
+
+    def expire(self, now=None):
+        """Drop lapsed sessions and return them."""
+        now = time.monotonic() if now is None else now
+        expired = [s for s in self.sessions.values() if s.expires is not None and s.expires <= now]
+        for session in expired:
+            self.discard(session)
+        return expired
+
+    def discard(self, session):
+        if session is None:
+            return
+        self.sessions.pop(session.token, None)
+        if self.by_client.get(session.client_id) is session:
+            del self.by_client[session.client_id]
+
+    def forget_stream(self, stream_name):
+        """A stream was closed; no session owns it any more."""
+        for session in self.sessions.values():
+            session.streams.discard(stream_name)
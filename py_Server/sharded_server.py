@@ -0,0 +1,321 @@
+"""Multi-process server: N workers share one port and coordinate over a routing bus.
+
+Every worker is a headless WebSocketServer listening with SO_REUSEPORT, so the
+kernel spreads incoming connections across processes. Workers exchange the
+state that must be global through a BusHub run by the supervisor process:
+
+- "clients": client join/leave announcements, so a worker knows which IDs
+  are connected elsewhere and to which worker. A join for an ID that is
+  still connected here means the client reconnected elsewhere; the stale
+  local connection is dropped.
+- "client/<id>": frames for a client, subscribed by the worker that owns it.
+- "broadcast": broadcast frames, delivered by every worker to its clients.
+- "streams": stream open/close announcements and publish policy changes.
+- "stream/<name>": stream updates. Every worker follows every open stream,
+  so each one has the current value and history of all streams and a
+  client sees the same data whichever worker it lands on. A worker that
+  (re)starts gets the current values on sync, and history from then on.
+- "sessions": the state of a resumable session whenever it changes, so a
+  client can resume on whichever worker it reconnects to.
+- "sync": sent by a starting worker; the others drop what they knew about
+  that worker's clients and sessions (it may have restarted) and
+  re-announce their state.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import time
+from typing import Dict, Set
+
+import json_codec
+from publish_policy import PublishPolicy
+from routing_bus import BusClient, BusHub
+from subscriptions import Subscription
+from websocket_server import WebSocketServer
+
+
+class ShardedWebSocketServer(WebSocketServer):
+    """A WebSocketServer worker that routes cross-worker traffic over the bus."""
+
+    def __init__(self, worker_id, bus_path, events=None):
+        super().__init__(events)
+        self.worker_id = worker_id
+        self.bus_path = bus_path
+        self.bus = None
+        self.reuse_port = True
+        self.remote_clients: Dict[str, Set[int]] = {}  # Client ID -> IDs of the other workers it is connected to
+        self.stream_topics = set()  # "stream/<name>" topics this worker is subscribed to
+        self.session_owners: Dict[str, int] = {}  # Session token -> worker its client is connected to
+
+    async def main(self):
+        # Without the bus this worker's state drifts from the others; stop so the supervisor restarts it
+        self.bus = BusClient(self.bus_path, self.on_bus_message, on_lost=self.stop)
+        await self.bus.connect()
+        for topic in ("clients", "broadcast", "streams", "sessions", "sync"):
+            self.bus.subscribe(topic)
+        self.publish_json("sync", {"worker_id": self.worker_id})
+        try:
+            await super().main()
+        finally:
+            await self.bus.close()
+
+    def register_metrics(self):
+        super().register_metrics()
+        self.metrics.gauge("ws_bus_dropped", "Messages this worker dropped because the routing bus fell behind",
+                           lambda: self.bus.dropped if self.bus is not None else 0)
+
+    def publish_json(self, topic, payload):
+        self.bus.publish(topic, json_codec.dumps(payload).encode())
+
+    async def on_bus_message(self, topic, payload):
+        if topic.startswith("stream/"):
+            update = json_codec.loads(payload)
+            await super().publish_stream(topic[len("stream/"):], update["data"], update["samples"])
+        elif topic.startswith("client/"):
+            super().deliver(topic[len("client/"):], payload.decode())
+        elif topic == "broadcast":
+            message = json_codec.loads(payload)
+            super().broadcast_frame(message["frame"], message["exclude"])
+        elif topic == "clients":
+            message = json_codec.loads(payload)
+            client_id = message["client_id"]
+            if message["event"] == "join":
+                self.remote_clients.setdefault(client_id, set()).add(message["worker_id"])
+                connection = self.clients.get(client_id)
+                if connection is not None and not message.get("sync"):
+                    logging.info(f"Client {client_id} reconnected to worker {message['worker_id']}, closing its previous connection")
+                    connection.abort()
+            else:
+                workers = self.remote_clients.get(client_id)
+                if workers is not None:
+                    workers.discard(message["worker_id"])
+                    if not workers:
+                        del self.remote_clients[client_id]
+        elif topic == "streams":
+            message = json_codec.loads(payload)
+            stream_name = message["stream_name"]
+            if message["event"] == "open":
+                if stream_name not in self.streams:
+                    super().open_stream(stream_name)
+                    self.follow_stream(stream_name)
+                if self.streams[stream_name] is None and message.get("data") is not None:
+                    self.streams[stream_name] = message["data"]
+            elif message["event"] == "close" and stream_name in self.streams:
+                super().remove_stream(stream_name)
+                self.unfollow_stream(stream_name)
+            elif message["event"] == "policy" and stream_name in self.streams:
+                super().set_publish_policy(stream_name, PublishPolicy.from_options(message["policy"]))
+        elif topic == "sessions":
+            self.on_session_message(json_codec.loads(payload))
+        elif topic == "sync":
+            self.forget_worker(json_codec.loads(payload)["worker_id"])
+            for client_id in self.clients:
+                self.publish_json("clients", {"event": "join", "client_id": client_id,
+                                              "worker_id": self.worker_id, "sync": True})
+            for stream_name, value in self.streams.items():
+                self.publish_json("streams", {"event": "open", "stream_name": stream_name, "data": value})
+            for stream_name, policy in self.publish_policies.items():
+                self.publish_json("streams", {"event": "policy", "stream_name": stream_name, "policy": policy.to_options()})
+            for session in self.sessions.sessions.values():
+                self.publish_session(session)
+
+    def forget_worker(self, worker_id):
+        """A worker (re)started: the clients it had are gone and their sessions are now resumable."""
+        for client_id, workers in list(self.remote_clients.items()):
+            workers.discard(worker_id)
+            if not workers:
+                del self.remote_clients[client_id]
+        for token, owner in list(self.session_owners.items()):
+            if owner == worker_id:
+                del self.session_owners[token]
+                session = self.sessions.sessions.get(token)
+                if session is not None:
+                    session.expires = time.monotonic() + self.session_ttl
+
+    def publish_session(self, session, released=False):
+        """Announce a session's state; `released` means this worker's client just disconnected."""
+        ttl = None if session.expires is None else max(0.0, session.expires - time.monotonic())
+        self.publish_json("sessions", {
+            "token": session.token,
+            "client_id": session.client_id,
+            "owner": self.session_owners.get(session.token) if ttl is None else None,
+            "released_by": self.worker_id if released else None,
+            "streams": list(session.streams),
+            "subscriptions": [subscription.to_message() for subscription in session.subscriptions],
+            "ttl": ttl,
+        })
+
+    def on_session_message(self, message):
+        session = self.sessions.adopt(message["token"], message["client_id"])
+        session.streams.update(message["streams"])
+        owner = self.session_owners.get(session.token)
+        if message["owner"] is not None:
+            # The client is connected to another worker; that worker restored its subscriptions
+            if message["owner"] != self.worker_id:
+                self.session_owners[session.token] = message["owner"]
+                session.subscriptions = []
+                session.expires = None
+        elif owner is not None and owner != message["released_by"]:
+            # The client resumed on `owner` before the worker it left noticed; hand its subscriptions over
+            if owner == self.worker_id and session.client_id in self.clients:
+                for options in message["subscriptions"]:
+                    self.add_subscription(Subscription.from_message(session.client_id, options))
+        else:
+            self.session_owners.pop(session.token, None)
+            session.subscriptions = [Subscription.from_message(session.client_id, options)
+                                     for options in message["subscriptions"]]
+            session.expires = time.monotonic() + message["ttl"]
+
+    def follow_stream(self, stream_name):
+        """Receive a stream's updates from the other workers."""
+        topic = f"stream/{stream_name}"
+        if topic not in self.stream_topics:
+            self.stream_topics.add(topic)
+            self.bus.subscribe(topic)
+
+    def unfollow_stream(self, stream_name):
+        topic = f"stream/{stream_name}"
+        if topic in self.stream_topics:
+            self.stream_topics.discard(topic)
+            self.bus.unsubscribe(topic)
+
+    def add_connection(self, connection):
+        super().add_connection(connection)
+        self.bus.subscribe(f"client/{connection.client_id}")
+        self.publish_json("clients", {"event": "join", "client_id": connection.client_id, "worker_id": self.worker_id})
+
+    async def remove_connection(self, client_id):
+        await super().remove_connection(client_id)
+        self.bus.unsubscribe(f"client/{client_id}")
+        self.publish_json("clients", {"event": "leave", "client_id": client_id, "worker_id": self.worker_id})
+        session = self.sessions.get(client_id)
+        if session is not None:
+            owner = self.session_owners.get(session.token)
+            if owner == self.worker_id:
+                del self.session_owners[session.token]
+            self.publish_session(session, released=True)
+            if owner is not None and owner != self.worker_id:
+                # The client already resumed on another worker, which now holds its subscriptions
+                session.subscriptions = []
+                session.expires = None
+
+    def start_session(self, connection):
+        super().start_session(connection)
+        self.claim_session(self.sessions.get(connection.client_id))
+
+    def resume_session(self, connection, session):
+        super().resume_session(connection, session)
+        self.claim_session(session)
+
+    def claim_session(self, session):
+        self.session_owners[session.token] = self.worker_id
+        self.publish_session(session)
+
+    def deliver(self, client_id, frame):
+        if super().deliver(client_id, frame):
+            return True
+        if self.remote_clients.get(client_id):
+            self.bus.publish(f"client/{client_id}", frame.encode())
+            return True
+        return False
+
+    def broadcast_frame(self, frame, exclude_client=None):
+        super().broadcast_frame(frame, exclude_client)
+        self.publish_json("broadcast", {"frame": frame, "exclude": exclude_client})
+
+    def open_stream(self, stream_name):
+        super().open_stream(stream_name)
+        self.follow_stream(stream_name)
+        self.publish_json("streams", {"event": "open", "stream_name": stream_name})
+
+    def remove_stream(self, stream_name):
+        super().remove_stream(stream_name)
+        self.unfollow_stream(stream_name)
+        self.publish_json("streams", {"event": "close", "stream_name": stream_name})
+
+    def set_publish_policy(self, stream_name, policy):
+        # Every worker applies the policy to the same updates, so they all push the same values
+        super().set_publish_policy(stream_name, policy)
+        self.publish_json("streams", {"event": "policy", "stream_name": stream_name,
+                                      "policy": policy.to_options() if policy else None})
+
+    async def publish_stream(self, stream_name, stream_data, samples=None):
+        await super().publish_stream(stream_name, stream_data, samples)
+        self.publish_json(f"stream/{stream_name}", {"data": stream_data, "samples": samples})
+
+
+def run_worker(worker_id, port, bus_path, metrics_port=None, options=None):
+    """Entry point of a worker process."""
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s [worker {worker_id}] %(message)s', force=True)
+    server = ShardedWebSocketServer(worker_id, bus_path)
+    server.port = port
+    if metrics_port is not None:
+        server.metrics_port = metrics_port + worker_id
+    for name, value in (options or {}).items():
+        setattr(server, name, value)
+
+    def request_stop(signum, frame):
+        server.stop()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    server.start()
+
+
+async def supervise(port, workers, bus_path, metrics_port=None, options=None):
+    hub = BusHub(bus_path)
+    await hub.start()
+
+    context = multiprocessing.get_context("spawn")
+
+    def spawn(worker_id):
+        process = context.Process(target=run_worker, args=(worker_id, port, bus_path, metrics_port, options), name=f"worker-{worker_id}")
+        process.start()
+        return process
+
+    processes = [spawn(i) for i in range(workers)]
+    logging.info(f"Started {workers} workers on port {port}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+            # Replace workers that died unexpectedly
+            for i, process in enumerate(processes):
+                if not stop.is_set() and not process.is_alive():
+                    logging.warning(f"Worker {i} exited with code {process.exitcode}, restarting")
+                    processes[i] = spawn(i)
+    finally:
+        logging.info("Stopping workers...")
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            await loop.run_in_executor(None, process.join)
+        await hub.close()
+        logging.info("All workers stopped.")
+
+
+def run_sharded(port, workers, metrics_port=None, options=None):
+    """Run `workers` server processes sharing `port`, until interrupted."""
+    if not hasattr(socket, "SO_REUSEPORT") or not hasattr(socket, "AF_UNIX"):
+        raise SystemExit("Sharded mode needs SO_REUSEPORT and Unix sockets (Linux or BSD).")
+    bus_dir = tempfile.mkdtemp(prefix="ws-bus-")
+    bus_path = os.path.join(bus_dir, "bus.sock")
+    try:
+        asyncio.run(supervise(port, workers, bus_path, metrics_port, options))
+    finally:
+        if os.path.exists(bus_path):
+            os.unlink(bus_path)
+        os.rmdir(bus_dir)
@@ -0,0 +1,95 @@
+from array import array
+
+
+class StreamHistory:
+    """Fixed-capacity ring buffer of (timestamp, value) samples for one stream.
+
+    Storage is two preallocated `array('d')` columns, so memory stays bounded
+    no matter how fast the stream runs. Only numeric values are kept; anything
+    that cannot be converted to float is ignored.
+    """
+
+    def __init__(self, capacity=1024):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.start = 0  # Index of the oldest sample
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        """Add a sample, overwriting the oldest one when the buffer is full."""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        end = (self.start + self.count) % self.capacity
+        self.timestamps[end] = timestamp
+        self.values[end] = value
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+        return True
+
+    def extend(self, samples):
+        """Add [timestamp, value] pairs, oldest first."""
+        for timestamp, value in samples:
+            self.append(timestamp, value)
+
+    def latest(self):
+        """Return the newest (timestamp, value) pair, or None if empty."""
+        if not self.count:
+            return None
+        index = (self.start + self.count - 1) % self.capacity
+        return self.timestamps[index], self.values[index]
+
+    def last(self, n=None):
+        """Return the newest `n` samples (all if None) as [timestamp, value] pairs, oldest first."""
+        if n is None or n > self.count:
+            n = self.count
+        return self.slice(self.count - n, self.count)
+
+    def window(self, start, end=None):
+        """Return samples with start < timestamp <= end, oldest first."""
+        first = self.index_after(start)
+        last = self.count if end is None else self.index_after(end)
+        return self.slice(first, max(first, last))
+
+    def values_after(self, start):
+        """Return the values of samples newer than `start` as an array('d').
+
+        This copies whole column ranges instead of building per-sample
+        objects, which keeps aggregation over a window cheap.
+        """
+        offset = self.index_after(start)
+        if offset == self.count:
+            return array('d')
+        first = (self.start + offset) % self.capacity
+        end = (self.start + self.count) % self.capacity
+        if first < end:
+            return self.values[first:end]
+        return self.values[first:] + self.values[:end]
+
+    def index_after(self, start):
+        """Return the logical index of the first sample newer than `start`.
+
+        Samples are assumed to arrive in time order, so the scan walks back
+        from the newest sample and stops at the first one at or before `start`.
+        """
+        i = self.count
+        while i > 0 and self.timestamps[(self.start + i - 1) % self.capacity] > start:
+            i -= 1
+        return i
+
+    def slice(self, first, last):
+        """Return logical samples [first, last) where 0 is the oldest."""
+        samples = []
+        for i in range(first, last):
+            index = (self.start + i) % self.capacity
+            samples.append([self.timestamps[index], self.values[index]])
+        return samples
@@ -0,0 +1,224 @@
+"""Append-only recordings of stream samples in memory-mapped column files.
+
+Each recorded stream gets two files in the recording directory, one per
+column: `<stream>.ts` holds timestamps and `<stream>.val` holds values, both
+as little-endian float64 after a 16-byte header (magic, sample count). The
+files grow in chunks and are trimmed to their sample count when closed, and
+a stream that is opened again keeps appending to the same files.
+
+The event loop only appends samples to in-memory arrays; a background task
+hands them to a single writer thread every `flush_interval` seconds, so
+recording never blocks message handling.
+"""
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+MAGIC = b"WSREC1\0\0"
+HEADER = struct.Struct("<8sQ")
+ITEM_SIZE = 8
+GROW_SAMPLES = 65536
+
+
+def column_paths(directory, stream_name):
+    # Stream names may contain "/" or other characters that are unsafe in file names
+    base = os.path.join(directory, quote(stream_name, safe=""))
+    return base + ".ts", base + ".val"
+
+
+def to_little_endian(values):
+    if sys.byteorder != "little":
+        values = array("d", values)
+        values.byteswap()
+    return values
+
+
+class ColumnFile:
+    """One append-only float64 column backed by a growing memory map."""
+
+    def __init__(self, path):
+        exists = os.path.exists(path) and os.path.getsize(path) >= HEADER.size
+        self.file = open(path, "r+b" if exists else "w+b")
+        if exists:
+            magic, self.count = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC:
+                self.file.close()
+                raise ValueError(f"{path} is not a stream recording")
+        else:
+            self.count = 0
+            self.file.write(HEADER.pack(MAGIC, 0))
+        self.capacity = 0
+        self.map = None
+        self.reserve(self.count + GROW_SAMPLES)
+
+    def reserve(self, samples):
+        if samples <= self.capacity:
+            return
+        size = HEADER.size + samples * ITEM_SIZE
+        self.file.truncate(size)
+        if self.map is None:
+            self.map = mmap.mmap(self.file.fileno(), size)
+        else:
+            self.map.resize(size)
+        self.capacity = samples
+
+    def append(self, values):
+        """Append an array('d') of values."""
+        if not values:
+            return
+        needed = self.count + len(values)
+        if needed > self.capacity:
+            self.reserve(max(needed, self.capacity * 2))
+        start = HEADER.size + self.count * ITEM_SIZE
+        data = memoryview(to_little_endian(values)).cast("B")
+        self.map[start:start + len(data)] = data
+        self.count = needed
+        self.map[:HEADER.size] = HEADER.pack(MAGIC, self.count)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(HEADER.size + self.count * ITEM_SIZE)
+        self.file.close()
+
+
+class StreamRecorder:
+    """Records stream samples into `directory`; see the module docstring."""
+
+    def __init__(self, directory, flush_interval=0.5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.pending = {}  # Stream name -> (timestamps, values) waiting to be written
+        self.columns = {}  # Stream name -> (timestamp column, value column); writer thread only
+        self.paused = set()  # Streams not recorded, e.g. while a replay feeds them
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream-recorder")
+        self.task = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def record(self, stream_name, timestamp, value):
+        """Queue one sample; values that cannot be converted to float are not recorded.
+
+        Numeric strings count as numbers, since that is how the ESP32 client
+        sends its readings.
+        """
+        if stream_name in self.paused:
+            return
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        pending = self.pending.get(stream_name)
+        if pending is None:
+            pending = self.pending[stream_name] = (array("d"), array("d"))
+        pending[0].append(timestamp)
+        pending[1].append(value)
+
+    def record_many(self, stream_name, samples):
+        """Queue a batch of [timestamp, value] pairs."""
+        for timestamp, value in samples:
+            self.record(stream_name, timestamp, value)
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self):
+        """Write everything queued so far on the writer thread."""
+        if not self.pending:
+            return
+        batches, self.pending = self.pending, {}
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.writer, self.write_batches, batches)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not write stream recording: {e}")
+
+    def write_batches(self, batches):
+        for stream_name, (timestamps, values) in batches.items():
+            columns = self.columns.get(stream_name)
+            if columns is None:
+                ts_path, value_path = column_paths(self.directory, stream_name)
+                columns = self.columns[stream_name] = (ColumnFile(ts_path), ColumnFile(value_path))
+            columns[0].append(timestamps)
+            columns[1].append(values)
+
+    def close_columns(self, stream_names=None):
+        for stream_name in list(self.columns) if stream_names is None else stream_names:
+            columns = self.columns.pop(stream_name, None)
+            if columns is not None:
+                columns[0].close()
+                columns[1].close()
+
+    async def close_stream(self, stream_name):
+        """Write out a closed stream's samples and trim its files."""
+        pending = self.pending.pop(stream_name, None)
+        loop = asyncio.get_running_loop()
+        try:
+            if pending is not None:
+                await loop.run_in_executor(self.writer, self.write_batches, {stream_name: pending})
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not write stream recording: {e}")
+        try:
+            await loop.run_in_executor(self.writer, self.close_columns, [stream_name])
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not close stream recording: {e}")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self.writer, self.close_columns)
+        self.writer.shutdown()
+
+
+def read_recording(directory, stream_name):
+    """Return (timestamps, values) of a recording as read-only float64 memoryviews."""
+    columns = []
+    for path in column_paths(directory, stream_name):
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack(data[:HEADER.size])
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a stream recording")
+        view = memoryview(data)[HEADER.size:HEADER.size + count * ITEM_SIZE].cast("d")
+        if sys.byteorder != "little":
+            view = memoryview(to_little_endian(view))
+        columns.append(view)
+    # The writer updates the timestamp column first, so trust the shorter of the two
+    count = min(len(columns[0]), len(columns[1]))
+    return columns[0][:count], columns[1][:count]
+
+
+async def replay(publish, timestamps, values, speed=1.0):
+    """Feed recorded samples to `publish(value)` in order.
+
+    `speed` scales the recorded timing (2 is twice as fast); 0 replays as
+    fast as possible, yielding to the event loop every few hundred samples.
+    """
+    if not len(timestamps):
+        return
+    loop = asyncio.get_running_loop()
+    first = timestamps[0]
+    started = loop.time()
+    for i in range(len(values)):
+        if speed > 0:
+            delay = (timestamps[i] - first) / speed - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif i % 256 == 255:
+            await asyncio.sleep(0)
+        await publish(values[i])
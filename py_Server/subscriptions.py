@@ -0,0 +1,146 @@
+import math
+import time
+
+from topic_matcher import is_wildcard, validate_pattern
+
+AGGREGATES = ("min", "max", "mean", "rms", "count")
+MAX_RATE = 1000.0  # Updates per second; faster timed delivery would just busy-loop the event loop
+
+
+def as_flag(value):
+    """Read a boolean option that may arrive as a string (the Unity client sends every field as one)."""
+    if isinstance(value, str):
+        if value.strip().lower() in ("", "0", "false", "no", "off"):
+            return False
+        return True
+    return bool(value)
+
+
+class Subscription:
+    """One client's subscription to a stream, with optional delivery options.
+
+    - `rate`: deliver at most this many updates per second (latest value per
+      interval) instead of forwarding every sample. Capped at MAX_RATE.
+    - `decimate`: forward only every Nth update.
+    - `aggregates`: with a rate, send min/max/mean/rms/count over the samples
+      received since the previous delivery. A single name may be given as a
+      plain string.
+    - `delta`: for dict values, send only the fields that changed. A stream's
+      first update is always sent in full, and so is the next one after the
+      client's send queue dropped anything or its session was resumed, so a
+      lost delta can't leave the subscriber out of step.
+    - `samples`: forward a producer's batches whole, as a `samples` list of
+      [timestamp, value] pairs. Off by default, because clients that parse
+      flat messages (like the Unity client) can't handle the nested list;
+      they get the newest value of each batch instead.
+
+    `stream_name` may be a wildcard pattern (see topic_matcher), in which
+    case the subscription covers every matching stream.
+    """
+
+    def __init__(self, client_id, stream_name, rate=None, decimate=1, aggregates=(), delta=False, samples=False):
+        if rate is not None and not (math.isfinite(rate) and 0 < rate <= MAX_RATE):
+            raise ValueError(f"rate must be a number between 0 and {MAX_RATE:g}")
+        if decimate < 1:
+            raise ValueError("decimate must be at least 1")
+        if isinstance(aggregates, str):
+            aggregates = (aggregates,)
+        unknown = [name for name in aggregates if name not in AGGREGATES]
+        if unknown:
+            raise ValueError(f"Unknown aggregates: {', '.join(unknown)}")
+        if aggregates and rate is None:
+            raise ValueError("aggregates need a rate")
+        if not isinstance(stream_name, str):
+            raise TypeError("stream_name must be a string")
+        validate_pattern(stream_name)
+        if aggregates and is_wildcard(stream_name):
+            raise ValueError("aggregates need a single stream, not a pattern")
+        self.client_id = client_id
+        self.stream_name = stream_name
+        self.rate = rate
+        self.decimate = decimate
+        self.aggregates = tuple(aggregates)
+        self.delta = delta
+        self.samples = samples
+        self.synced = set()  # Streams whose last full value the delta subscriber is known to have
+        self.drops_seen = 0  # The connection's drop count when `synced` was last checked
+        self.skipped = 0  # Updates skipped since the last forwarded one, for decimation
+        self.pending = set()  # Streams with a new value since the last timed delivery
+        self.last_delivery = time.time()  # Timestamp of the newest sample already aggregated
+        self.task = None  # Timed delivery task for rate-limited subscriptions
+
+    @classmethod
+    def from_message(cls, client_id, data):
+        """Build a subscription from the options of a subscribe_stream message."""
+        rate = data.get("rate")
+        return cls(
+            client_id,
+            data.get("stream_name"),
+            rate=None if rate is None else float(rate),
+            decimate=int(data.get("decimate", 1)),
+            aggregates=data.get("aggregate", ()),
+            delta=as_flag(data.get("delta", False)),
+            samples=as_flag(data.get("samples", False)),
+        )
+
+    def to_message(self):
+        """Return the subscribe_stream options that recreate this subscription."""
+        return {
+            "stream_name": self.stream_name,
+            "rate": self.rate,
+            "decimate": self.decimate,
+            "aggregate": list(self.aggregates),
+            "delta": self.delta,
+            "samples": self.samples,
+        }
+
+    @property
+    def immediate(self):
+        """True if updates are forwarded as they arrive rather than on a timer."""
+        return self.rate is None
+
+    def accept(self, updates=1):
+        """Count incoming updates and report whether this one should be forwarded."""
+        if self.decimate == 1:
+            return True
+        self.skipped += updates
+        if self.skipped < self.decimate:
+            return False
+        self.skipped = 0
+        return True
+
+    def reset(self):
+        """Forget per-connection delivery state, so a resumed session starts from full values."""
+        self.synced.clear()
+        self.drops_seen = 0
+        self.skipped = 0
+        self.pending.clear()
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+def compute_aggregates(values, names):
+    """Compute the named aggregates over an array of floats.
+
+    Works on whole arrays with C-level builtins (min, max, math.fsum over
+    map) rather than a Python loop per sample.
+    """
+    result = {}
+    count = len(values)
+    for name in names:
+        if name == "count":
+            result[name] = count
+        elif not count:
+            result[name] = None
+        elif name == "min":
+            result[name] = min(values)
+        elif name == "max":
+            result[name] = max(values)
+        elif name == "mean":
+            result[name] = math.fsum(values) / count
+        elif name == "rms":
+            result[name] = math.sqrt(math.fsum(map(float.__mul__, values, values)) / count)
+    return result
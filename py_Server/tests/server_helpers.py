@@ -0,0 +1,58 @@
+"""Run WebSocketServer in-process with stand-in sockets.
+
+Messages queued for a client stay in its ClientConnection queue (no writer
+task runs), so tests read them with `sent`.
+"""
+import json
+
+from client_connection import ClientConnection
+
+
+class FakeWebSocket:
+    """Yields `incoming` to listen_to_client and counts how many were consumed.
+
+    `recv` hands out the first message instead, for register's handshake.
+    """
+
+    def __init__(self, incoming=()):
+        self.incoming = list(incoming)
+        self.consumed = 0
+
+    async def __aiter__(self):
+        for message in self.incoming:
+            self.consumed += 1
+            yield message
+
+    async def recv(self):
+        return self.incoming.pop(0)
+
+    async def send(self, message):
+        pass
+
+    async def close(self):
+        pass
+
+
+def connect(server, client_id):
+    """Make a client addressable without a socket or writer task."""
+    connection = ClientConnection(client_id, FakeWebSocket(), server.send_queue_size, server.overflow_policy)
+    server.clients[client_id] = connection
+    return connection
+
+
+def sent(connection):
+    """Decode and clear the messages queued for a client."""
+    messages = [json.loads(message) for _, message in connection.queue]
+    connection.queue.clear()
+    connection.pending.clear()
+    return messages
+
+
+async def feed(server, client_id, *messages):
+    """Pass raw messages through the full receive path (fast path, decoding, dispatch).
+
+    Returns the number of messages handled before the connection would have been dropped.
+    """
+    websocket = FakeWebSocket(json.dumps(m) if not isinstance(m, (str, bytes)) else m for m in messages)
+    await server.listen_to_client(client_id, websocket)
+    return websocket.consumed
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from binary_protocol import HEADER, FrameError, decode_frame, encode_frame
+from server_helpers import connect, feed, sent
+from websocket_server import WebSocketServer
+
+
+@pytest.mark.parametrize("sample_type, samples", [
+    (b"f", [1.5, -2.25, 0.0]),
+    (b"d", [1e300, -3.141592653589793]),
+    (b"i", [0, -1, 2 ** 31 - 1]),
+    (b"h", [-32768, 32767]),
+])
+def test_round_trip(sample_type, samples):
+    stream_id, timestamps, decoded = decode_frame(encode_frame(513, samples, sample_type))
+    assert stream_id == 513
+    assert timestamps is None
+    assert list(decoded) == samples
+
+
+def test_timestamped_round_trip():
+    frame = encode_frame(7, [1.5, 2.5], b"f", timestamps=[1000, 4294967295])
+    stream_id, timestamps, samples = decode_frame(frame)
+    assert stream_id == 7
+    assert list(timestamps) == [1000, 4294967295]
+    assert list(samples) == [1.5, 2.5]
+
+
+def test_single_float_frame_is_ten_bytes():
+    assert len(encode_frame(1, [1.0])) == 10
+
+
+def test_empty_frames():
+    assert list(decode_frame(encode_frame(1, []))[2]) == []
+    assert decode_frame(encode_frame(1, [], timestamps=[]))[1:] == ((), ())
+
+
+@pytest.mark.parametrize("frame", [
+    b"\x01f\x01",  # Shorter than the header
+    encode_frame(1, [1.0, 2.0])[:-1],  # Truncated sample
+    encode_frame(1, [1.0]) + b"\x00",  # Trailing byte
+    encode_frame(1, [1.0], timestamps=[5])[:-4],  # Timestamped frame missing its value
+    HEADER.pack(1, b"f", 1, 3) + b"\x00" * 8,  # Count larger than the payload
+    HEADER.pack(9, b"f", 1, 0),  # Unknown version
+    HEADER.pack(1, b"q", 1, 0),  # Unknown sample type
+])
+def test_malformed_frames_are_rejected(frame):
+    with pytest.raises(FrameError):
+        decode_frame(frame)
+
+
+def test_encode_rejects_bad_input():
+    with pytest.raises(FrameError):
+        encode_frame(1, [1.0], b"q")
+    with pytest.raises(FrameError):
+        encode_frame(1, [1.0, 2.0], timestamps=[1])
+
+
+def test_server_publishes_binary_frames():
+    async def run():
+        server = WebSocketServer()
+        producer = connect(server, "esp32")
+        subscriber = connect(server, "unity")
+        await feed(server, "esp32", {"command": "start_stream", "stream_name": "imu", "binary": True})
+        stream_id = sent(producer)[0]["stream_id"]
+        await feed(server, "unity", {"command": "subscribe_stream", "stream_name": "imu"})
+        handled = await feed(server, "esp32", encode_frame(stream_id, [0.5, 1.5]), encode_frame(999, [1.0]))
+        return handled, sent(subscriber)
+    handled, received = asyncio.run(run())
+    assert handled == 2  # An unknown stream ID is logged, not fatal
+    assert [m["data"] for m in received if m["command"] == "stream_data"] == [1.5]
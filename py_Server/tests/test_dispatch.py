@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+
+from command_registry import CommandRegistry, commands
+from server_helpers import connect, feed, sent
+from websocket_server import WebSocketServer, sniff_stream_data
+
+SNIFFABLE = [
+    '{"command": "stream_data", "stream_name": "temp", "data": 21}',
+    '{"command":"stream_data","stream_name":"temp","data":-0.5e3}',
+    '{"command": "stream_data", "stream_name": "room/1/temp", "client_id": "esp32", "data": "5.23"}',
+    '{"command": "stream_data", "stream_name": "temp", "data": 0}\n',
+]
+
+NOT_SNIFFABLE = [
+    '{"command": "stream_data", "stream_name": "temp", "data": {"a": 1}}',
+    '{"command": "stream_data", "stream_name": "temp", "data": "say \\"hi\\""}',
+    '{"command": "stream_data", "stream_name": "te\\u006dp", "data": 1}',
+    '{"command": "stream_data", "stream_name": "temp", "data": 1, "samples": []}',
+    '{"command": "stream_data", "stream_name": "temp", "data": 01}',
+    '{"command": "stream_data", "stream_name": "temp", "data": NaN}',
+    '{"stream_name": "temp", "command": "stream_data", "data": 1}',
+    '{"command": "start_stream", "stream_name": "temp"}',
+]
+
+
+@pytest.mark.parametrize("message", SNIFFABLE)
+def test_sniff_matches_json_decoding(message):
+    data = json.loads(message)
+    assert sniff_stream_data(message) == (data["stream_name"], data["data"])
+
+
+@pytest.mark.parametrize("message", NOT_SNIFFABLE)
+def test_sniff_leaves_other_messages_to_the_decoder(message):
+    assert sniff_stream_data(message) is None
+
+
+def test_fast_path_and_decoder_publish_the_same_values():
+    async def run():
+        server = WebSocketServer()
+        connect(server, "esp32")
+        await feed(server, "esp32", {"command": "start_stream", "stream_name": "temp"})
+        values = []
+        for message in SNIFFABLE[:2] + ['{"command": "stream_data", "data": 2.5, "stream_name": "temp"}']:
+            await feed(server, "esp32", message)
+            values.append(server.streams["temp"])
+        return values
+    assert asyncio.run(run()) == [21, -500.0, 2.5]
+
+
+def test_bad_messages_are_logged_without_dropping_the_client():
+    async def run():
+        server = WebSocketServer()
+        connect(server, "unity")
+        return await feed(server, "unity", "[]", "5", '"text"', {"command": "no_such_command"},
+                          {"command": "start_stream"}, {"command": "start_stream", "stream_name": 5},
+                          {"command": "start_stream", "stream_name": "ok"})
+    assert asyncio.run(run()) == 7
+
+
+@pytest.mark.parametrize("target_id", [7, "7"])
+def test_send_to_client_accepts_numeric_ids(target_id):
+    async def run():
+        server = WebSocketServer()
+        connect(server, "unity")
+        esp32 = connect(server, "7")
+        await feed(server, "unity", {"command": "send_to_client", "target_id": target_id, "data": "on"})
+        return sent(esp32)
+    assert [m["data"] for m in asyncio.run(run())] == ["on"]
+
+
+def test_registered_command_replaces_the_fast_path():
+    async def run():
+        server = WebSocketServer()
+        server.commands = CommandRegistry()
+        server.commands.commands.update(commands.commands)  # A private copy, so the shared registry is untouched
+        seen = []
+
+        async def handle(server, client_id, data):
+            seen.append(data["data"])
+        server.commands.register("stream_data", handle)
+        connect(server, "esp32")
+        await feed(server, "esp32", SNIFFABLE[0])
+        return seen
+    assert asyncio.run(run()) == [21]
@@ -0,0 +1,28 @@
+import json
+
+from metrics import MetricsRegistry
+
+
+def test_histogram_quantile_beyond_last_bucket_is_none():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Test", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(50.0)
+    snapshot = histogram.snapshot()
+    assert snapshot["p50"] == 0.1
+    assert snapshot["p99"] is None
+    json.dumps(registry.snapshot(), allow_nan=False)
+
+
+def test_render_labels_and_buckets():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test", "command")
+    counter.inc("ping")
+    counter.inc("ping")
+    histogram = registry.histogram("test_seconds", "Test", buckets=(0.1, 1.0))
+    histogram.observe(0.5)
+    text = registry.render()
+    assert 'test_total{command="ping"} 2' in text
+    assert 'test_seconds_bucket{le="0.1"} 0' in text
+    assert 'test_seconds_bucket{le="1.0"} 1' in text
+    assert 'test_seconds_bucket{le="+Inf"} 1' in text
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from publish_policy import KEYFRAME, SEND, SUPPRESS, PublishPolicy, as_number, compute_delta
+from server_helpers import connect, feed, sent
+from websocket_server import WebSocketServer
+
+
+def test_first_value_is_a_keyframe():
+    assert PublishPolicy(on_change=True).check(None, 1, 0.0) == KEYFRAME
+
+
+def test_on_change():
+    policy = PublishPolicy(on_change=True)
+    assert policy.check(1, 1, 0.0) == SUPPRESS
+    assert policy.check(1, 2, 0.0) == SEND
+    assert policy.check({"a": 1}, {"a": 1}, 0.0) == SUPPRESS
+
+
+def test_deadband_edges():
+    policy = PublishPolicy(deadband=0.5)
+    assert policy.check(10.0, 10.5, 0.0) == SUPPRESS  # Exactly on the band is inside it
+    assert policy.check(10.0, 9.5, 0.0) == SUPPRESS
+    assert policy.check(10.0, 10.51, 0.0) == SEND
+    assert policy.check("10.0", "10.2", 0.0) == SUPPRESS  # Numeric strings from the ESP32
+    assert policy.check("on", "off", 0.0) == SEND  # Non-numeric values are always sent
+
+
+def test_relative_deadband_uses_last_value_sent():
+    policy = PublishPolicy(relative_deadband=0.1)
+    assert policy.check(100.0, 109.0, 0.0) == SUPPRESS
+    assert policy.check(100.0, 111.0, 0.0) == SEND
+    assert policy.check(0.0, 0.001, 0.0) == SEND  # No band around zero
+
+
+def test_keyframe_interval():
+    policy = PublishPolicy(on_change=True, keyframe_interval=5.0)
+    assert policy.check(1, 1, 0.0) == KEYFRAME
+    assert policy.check(1, 1, 4.9) == SUPPRESS
+    assert policy.check(1, 1, 5.0) == KEYFRAME
+    assert policy.check(1, 2, 6.0) == SEND
+
+
+def test_from_options():
+    assert PublishPolicy.from_options({}) is None
+    assert PublishPolicy.from_options({"on_change": False, "deadband": 0}) is None
+    assert PublishPolicy.from_options({"on_change": "false", "deadband": "0"}) is None  # Unity sends strings
+    assert PublishPolicy.from_options({"on_change": "true"}).on_change
+    assert not PublishPolicy.from_options({"on_change": "false", "deadband": "0.1"}).on_change
+    policy = PublishPolicy.from_options({"deadband": "0.5", "keyframe_interval": 10})
+    assert policy.to_options() == {"on_change": False, "deadband": 0.5, "relative_deadband": 0.0,
+                                   "keyframe_interval": 10.0}
+    with pytest.raises(ValueError):
+        PublishPolicy.from_options({"deadband": -1})
+
+
+def test_as_number():
+    assert as_number("5.23") == 5.23
+    assert as_number(3) == 3.0
+    assert as_number(True) is None
+    assert as_number("nan") is None
+    assert as_number("abc") is None
+    assert as_number(None) is None
+
+
+def test_compute_delta():
+    changed, removed = compute_delta({"a": 1, "b": 2, "c": 3}, {"a": 1, "b": 5, "d": 4})
+    assert changed == {"b": 5, "d": 4}
+    assert removed == ["c"]
+    assert compute_delta({"a": 1}, {"a": 1}) == ({}, [])
+
+
+def test_resumed_delta_subscriber_gets_a_full_value_first():
+    async def run():
+        server = WebSocketServer()
+        connect(server, "esp32")
+        unity = connect(server, "unity")
+        server.start_session(unity)
+        token = sent(unity)[0]["session"]
+        await feed(server, "esp32", {"command": "start_stream", "stream_name": "s"})
+        await feed(server, "unity", {"command": "subscribe_stream", "stream_name": "s", "delta": "true"})
+        publish = {"command": "stream_data", "stream_name": "s"}
+        await feed(server, "esp32", {**publish, "data": {"a": 1, "b": 2}}, {**publish, "data": {"a": 1, "b": 3}})
+        before = sent(unity)
+
+        # The queued delta is lost with the connection; another update arrives while the client is away
+        await feed(server, "esp32", {**publish, "data": {"a": 1, "b": 4}})
+        await server.remove_connection("unity")
+        await feed(server, "esp32", {**publish, "data": {"a": 2, "b": 4}})
+
+        unity = connect(server, "unity")
+        server.resume_session(unity, server.sessions.resume(token))
+        await feed(server, "esp32", {**publish, "data": {"a": 2, "b": 5}}, {**publish, "data": {"a": 3, "b": 5}})
+        return before, sent(unity)[1:]  # Skip the session reply
+    before, after = asyncio.run(run())
+    assert [m.get("data", m.get("delta")) for m in before] == [{"a": 1, "b": 2}, {"b": 3}]
+    assert after[0]["data"] == {"a": 2, "b": 5}
+    assert after[1]["delta"] == {"a": 3}
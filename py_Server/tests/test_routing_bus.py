@@ -0,0 +1,88 @@
+import asyncio
+
+from routing_bus import OP_PUBLISH, OP_SUBSCRIBE, BusClient, BusHub, encode_frame
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_hub_routes_frames_to_other_subscribers(tmp_path):
+    async def run():
+        hub = BusHub(str(tmp_path / "bus.sock"))
+        await hub.start()
+        received = []
+
+        async def handler(topic, payload):
+            received.append((topic, payload))
+        sender = BusClient(hub.path, handler)
+        receiver = BusClient(hub.path, handler)
+        for client in (sender, receiver):
+            await client.connect()
+            client.subscribe("t")
+        await wait_for(lambda: len(hub.topics.get("t", ())) == 2)
+        sender.publish("t", b"hello")
+        await wait_for(lambda: received)
+        for client in (sender, receiver):
+            await client.close()
+        await hub.close()
+        return received
+    assert asyncio.run(run()) == [("t", b"hello")]  # Not echoed back to the sender
+
+
+def test_hub_disconnects_a_worker_that_stops_reading(tmp_path):
+    async def run():
+        hub = BusHub(str(tmp_path / "bus.sock"), max_buffer=64 * 1024)
+        await hub.start()
+        _, stuck = await asyncio.open_unix_connection(hub.path)
+        stuck.write(encode_frame(OP_SUBSCRIBE, "t"))
+        await wait_for(lambda: hub.topics.get("t"))
+        _, publisher = await asyncio.open_unix_connection(hub.path)
+        frame = encode_frame(OP_PUBLISH, "t", bytes(1024 * 1024))
+        for _ in range(32):
+            if "t" not in hub.topics:
+                break
+            publisher.write(frame)
+            await publisher.drain()
+        await wait_for(lambda: "t" not in hub.topics)
+        publisher.close()
+        stuck.close()
+        await hub.close()
+    asyncio.run(run())
+
+
+def test_client_drops_publishes_when_the_hub_falls_behind(tmp_path):
+    async def run():
+        async def never_read(reader, writer):
+            await asyncio.sleep(3600)
+        server = await asyncio.start_unix_server(never_read, path=str(tmp_path / "bus.sock"))
+        client = BusClient(str(tmp_path / "bus.sock"), None, max_buffer=0)
+        await client.connect()
+        for _ in range(64):
+            client.publish("t", bytes(1024 * 1024))
+            if client.dropped:
+                break
+        dropped = client.dropped
+        client.writer.transport.abort()
+        await client.close()
+        server.close()
+        return dropped
+    assert asyncio.run(run()) > 0
+
+
+def test_client_reports_a_lost_hub(tmp_path):
+    async def run():
+        lost = asyncio.Event()
+
+        async def hang_up(reader, writer):
+            writer.close()
+        server = await asyncio.start_unix_server(hang_up, path=str(tmp_path / "bus.sock"))
+        client = BusClient(str(tmp_path / "bus.sock"), None, on_lost=lost.set)
+        await client.connect()
+        await asyncio.wait_for(lost.wait(), 5)
+        await client.close()
+        server.close()
+    asyncio.run(run())
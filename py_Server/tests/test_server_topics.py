@@ -0,0 +1,40 @@
+import asyncio
+
+from server_helpers import connect, feed, sent
+from websocket_server import WebSocketServer
+
+
+def test_overlapping_patterns_deliver_each_update_once():
+    async def run():
+        server = WebSocketServer()
+        producer = connect(server, "producer")
+        subscriber = connect(server, "subscriber")
+        await feed(server, "subscriber",
+                   {"command": "subscribe_stream", "stream_name": "room/+/temp"},
+                   {"command": "subscribe_stream", "stream_name": "room/#"},
+                   {"command": "subscribe_stream", "stream_name": "room/a/temp"})
+        await feed(server, "producer",
+                   {"command": "start_stream", "stream_name": "room/a/temp"},
+                   '{"command": "stream_data", "stream_name": "room/a/temp", "data": "21.5"}',
+                   {"command": "stream_data", "stream_name": "room/b", "data": 1})
+        return sent(subscriber), sent(producer)
+    received, _ = asyncio.run(run())
+    updates = [(m["stream_name"], m["data"]) for m in received if m["command"] == "stream_data"]
+    assert updates == [("room/a/temp", "21.5"), ("room/b", 1)]
+
+
+def test_wildcard_names_are_not_streams():
+    async def run():
+        server = WebSocketServer()
+        connect(server, "producer")
+        subscriber = connect(server, "subscriber")
+        await feed(server, "subscriber", {"command": "subscribe_stream", "stream_name": "room/+"})
+        handled = await feed(server, "producer",
+                             {"command": "start_stream", "stream_name": "room/#"},
+                             '{"command": "stream_data", "stream_name": "room/+", "data": 1}',  # Fast-path shape
+                             {"command": "stream_data", "stream_name": "room/#", "samples": [[0, 1]]})
+        return server, handled, sent(subscriber)
+    server, handled, received = asyncio.run(run())
+    assert handled == 3
+    assert not server.streams
+    assert received == []
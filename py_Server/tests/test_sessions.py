@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+from server_helpers import FakeWebSocket, connect, sent
+from sessions import SessionStore
+from subscriptions import Subscription
+from websocket_server import WebSocketServer
+
+
+def test_released_session_expires_after_ttl():
+    store = SessionStore()
+    session = store.create("unity")
+    store.release("unity", 10.0)
+    assert store.expire(session.expires - 1) == []
+    assert store.resume(session.token) is session
+    store.release("unity", 10.0)
+    assert store.expire(session.expires) == [session]
+    assert store.resume(session.token) is None
+    assert store.get("unity") is None
+
+
+def test_new_session_replaces_the_clients_previous_one():
+    store = SessionStore()
+    old = store.create("unity")
+    new = store.create("unity")
+    assert store.resume(old.token) is None
+    assert store.get("unity") is new
+    assert len(store) == 1
+
+
+def test_unknown_tokens_are_not_resumed():
+    store = SessionStore()
+    assert store.resume("nope") is None
+    assert store.resume(["not", "a", "token"]) is None
+
+
+def test_subscription_to_message_round_trip():
+    subscription = Subscription("c", "room/+/temp", rate=5.0, decimate=3, delta=True, samples=True)
+    copy = Subscription.from_message("c", subscription.to_message())
+    assert copy.to_message() == subscription.to_message()
+
+
+def test_resume_restores_subscriptions_and_streams():
+    async def run():
+        server = WebSocketServer()
+        token = server.sessions.create("unity").token
+        await server.register(FakeWebSocket([
+            json.dumps({"command": "resume", "session": token}),
+            json.dumps({"command": "start_stream", "stream_name": "unity/pose"}),
+            json.dumps({"command": "subscribe_stream", "stream_name": "room/+/temp", "decimate": "2", "delta": "true"}),
+        ]))
+        disconnected = not server.subscribers and "unity" not in server.clients
+
+        connection = connect(server, "unity")
+        server.resume_session(connection, server.sessions.resume(token))
+        restored = [subs["unity"].to_message() for subs in server.subscribers.values()]
+        return disconnected, restored, sent(connection)
+    disconnected, restored, replies = asyncio.run(run())
+    assert disconnected
+    assert restored == [{"stream_name": "room/+/temp", "rate": None, "decimate": 2, "aggregate": [],
+                         "delta": True, "samples": False}]
+    assert replies == [{"command": "session", "session": replies[0]["session"], "client_id": "unity",
+                        "resumed": True, "streams": {"unity/pose": None}}]
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from server_helpers import connect, feed, sent
+from stream_history import StreamHistory
+from websocket_server import WebSocketServer
+
+
+def filled(capacity, count):
+    history = StreamHistory(capacity)
+    for i in range(count):
+        history.append(float(i), i)
+    return history
+
+
+def test_wraparound_keeps_newest_samples_in_order():
+    history = filled(3, 5)
+    assert len(history) == 3
+    assert history.last() == [[2.0, 2.0], [3.0, 3.0], [4.0, 4.0]]
+    assert history.last(2) == [[3.0, 3.0], [4.0, 4.0]]
+    assert history.latest() == (4.0, 4.0)
+
+
+def test_last_with_more_than_stored():
+    history = filled(4, 2)
+    assert history.last(10) == [[0.0, 0.0], [1.0, 1.0]]
+    assert history.last(0) == []
+
+
+def test_window_across_wraparound():
+    history = filled(4, 7)  # Holds timestamps 3..6, wrapped
+    assert history.window(4.0) == [[5.0, 5.0], [6.0, 6.0]]
+    assert history.window(3.0, 5.0) == [[4.0, 4.0], [5.0, 5.0]]
+    assert history.window(10.0) == []
+    assert history.window(0.0) == history.last()
+
+
+def test_values_after_across_wraparound():
+    history = filled(4, 7)
+    assert list(history.values_after(3.0)) == [4.0, 5.0, 6.0]
+    assert list(history.values_after(6.0)) == []
+
+
+def test_numeric_strings_are_stored_and_others_ignored():
+    history = StreamHistory(4)
+    assert history.append(1.0, "5.23")
+    assert not history.append(2.0, "on")
+    assert not history.append(3.0, None)
+    assert not history.append(4.0, {"x": 1})
+    assert history.last() == [[1.0, 5.23]]
+
+
+def test_empty_history():
+    history = StreamHistory(2)
+    assert history.latest() is None
+    assert history.last() == []
+    assert list(history.values_after(0.0)) == []
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        StreamHistory(0)
+
+
+def test_history_requests_accept_unity_strings_and_survive_bad_values():
+    async def run():
+        server = WebSocketServer()
+        connect(server, "esp32")
+        unity = connect(server, "unity")
+        await feed(server, "esp32", {"command": "start_stream", "stream_name": "s"},
+                   *({"command": "stream_data", "stream_name": "s", "data": str(v)} for v in range(3)))
+        handled = await feed(server, "unity",
+                             {"command": "request_stream_history", "stream_name": "s", "count": "2"},
+                             {"command": "request_stream_history", "stream_name": "s", "seconds": "abc"},
+                             {"command": "request_stream_history", "stream_name": "s", "count": [1]},
+                             {"command": "request_stream_history", "stream_name": "s", "seconds": "60"})
+        return handled, sent(unity)
+    handled, received = asyncio.run(run())
+    assert handled == 4
+    assert [[value for _, value in m["samples"]] for m in received] == [[1.0, 2.0], [0.0, 1.0, 2.0]]
@@ -0,0 +1,60 @@
+import asyncio
+
+from stream_recorder import StreamRecorder, read_recording
+
+
+def record(directory, samples, stream_name="esp32Stream1"):
+    async def run():
+        recorder = StreamRecorder(str(directory), flush_interval=60)
+        for timestamp, value in samples:
+            recorder.record(stream_name, timestamp, value)
+        await recorder.stop()
+    asyncio.run(run())
+    timestamps, values = read_recording(str(directory), stream_name)
+    return list(timestamps), list(values)
+
+
+def test_records_numeric_strings(tmp_path):
+    # The ESP32 client sends its readings as strings, e.g. "data": "5.23"
+    timestamps, values = record(tmp_path, [(1.0, "5.23"), (2.0, 7), (3.0, 1.5)])
+    assert timestamps == [1.0, 2.0, 3.0]
+    assert values == [5.23, 7.0, 1.5]
+
+
+def test_skips_values_that_are_not_numbers(tmp_path):
+    timestamps, values = record(tmp_path, [(1.0, "on"), (2.0, {"x": 1}), (3.0, None), (4.0, "4")])
+    assert timestamps == [4.0]
+    assert values == [4.0]
+
+
+def test_reopened_stream_keeps_appending(tmp_path):
+    record(tmp_path, [(1.0, 1)])
+    timestamps, values = record(tmp_path, [(2.0, 2)])
+    assert timestamps == [1.0, 2.0]
+    assert values == [1.0, 2.0]
+
+
+def test_paused_streams_are_not_recorded(tmp_path):
+    async def run():
+        recorder = StreamRecorder(str(tmp_path))
+        recorder.paused.add("replayed")
+        recorder.record("replayed", 1.0, 1)
+        assert not recorder.pending
+        await recorder.stop()
+    asyncio.run(run())
+
+
+def test_write_errors_on_close_are_logged(tmp_path, caplog):
+    def fail(*args):
+        raise OSError("disk full")
+
+    async def run():
+        recorder = StreamRecorder(str(tmp_path), flush_interval=60)
+        recorder.record("s", 1.0, 1)
+        recorder.write_batches = fail
+        recorder.close_columns = fail
+        await recorder.close_stream("s")  # Must not raise into the fire-and-forget task
+        recorder.writer.shutdown()
+    asyncio.run(run())
+    assert "Could not write stream recording: disk full" in caplog.text
+    assert "Could not close stream recording: disk full" in caplog.text
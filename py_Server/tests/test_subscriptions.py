@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from server_helpers import connect, feed, sent
+from subscriptions import MAX_RATE, Subscription, as_flag, compute_aggregates
+from websocket_server import WebSocketServer
+
+
+@pytest.mark.parametrize("value, expected", [
+    (True, True), (False, False), (None, False), (1, True), (0, False),
+    ("true", True), ("True", True), ("1", True), ("false", False), ("False", False), ("0", False), ("", False),
+])
+def test_as_flag(value, expected):
+    assert as_flag(value) is expected
+
+
+def test_from_message_reads_unity_string_options():
+    subscription = Subscription.from_message("unity", {"stream_name": "s", "delta": "false", "samples": "true",
+                                                        "rate": "10", "decimate": "2"})
+    assert not subscription.delta
+    assert subscription.samples
+    assert subscription.rate == 10.0
+    assert subscription.decimate == 2
+
+
+@pytest.mark.parametrize("options", [
+    {"rate": 0},
+    {"rate": float("inf")},
+    {"rate": float("nan")},
+    {"rate": MAX_RATE * 2},
+    {"decimate": 0},
+    {"aggregates": ["median"]},
+    {"aggregates": "median"},
+    {"aggregates": ["min"]},  # Aggregates need a rate
+])
+def test_invalid_options(options):
+    with pytest.raises(ValueError):
+        Subscription("c", "s", **options)
+
+
+@pytest.mark.parametrize("rate", ["inf", "nan", "-1"])
+def test_from_message_rejects_unusable_rates(rate):
+    with pytest.raises(ValueError):
+        Subscription.from_message("unity", {"stream_name": "s", "rate": rate})
+
+
+def test_single_aggregate_name_as_string():
+    subscription = Subscription.from_message("unity", {"stream_name": "s", "rate": "5", "aggregate": "mean"})
+    assert subscription.aggregates == ("mean",)
+
+
+def test_aggregates_need_a_single_stream():
+    with pytest.raises(ValueError):
+        Subscription("c", "room/#", rate=1, aggregates=["mean"])
+
+
+def test_decimation_forwards_every_nth_update():
+    subscription = Subscription("c", "s", decimate=3)
+    assert [subscription.accept() for _ in range(6)] == [False, False, True, False, False, True]
+
+
+def test_compute_aggregates():
+    result = compute_aggregates([3.0, -4.0], ("min", "max", "mean", "rms", "count"))
+    assert result == {"min": -4.0, "max": 3.0, "mean": -0.5, "rms": pytest.approx(12.5 ** 0.5), "count": 2}
+    assert compute_aggregates([], ("mean", "count")) == {"mean": None, "count": 0}
+
+
+def test_server_ignores_unusable_rates_and_decimates():
+    async def run():
+        server = WebSocketServer()
+        connect(server, "esp32")
+        unity = connect(server, "unity")
+        await feed(server, "esp32", {"command": "start_stream", "stream_name": "s"})
+        handled = await feed(server, "unity",
+                             {"command": "subscribe_stream", "stream_name": "s", "rate": "inf"},
+                             {"command": "subscribe_stream", "stream_name": "s", "rate": "nan"})
+        rejected = "s" not in server.subscribers
+        await feed(server, "unity", {"command": "subscribe_stream", "stream_name": "s", "decimate": "2"})
+        await feed(server, "esp32", *({"command": "stream_data", "stream_name": "s", "data": v} for v in range(4)))
+        return handled, rejected, sent(unity)
+    handled, rejected, received = asyncio.run(run())
+    assert handled == 2 and rejected
+    assert [m["data"] for m in received] == [1, 3]
+
+
+def test_only_subscribers_that_ask_for_samples_get_batches():
+    async def run():
+        server = WebSocketServer()
+        connect(server, "esp32")
+        plain = connect(server, "unity")
+        batched = connect(server, "dashboard")
+        await feed(server, "esp32", {"command": "start_stream", "stream_name": "s"})
+        await feed(server, "unity", {"command": "subscribe_stream", "stream_name": "s", "samples": "false"})
+        await feed(server, "dashboard", {"command": "subscribe_stream", "stream_name": "s", "samples": "true"})
+        handled = await feed(server, "esp32",
+                             {"command": "stream_data", "stream_name": "s", "samples": [[0, 1], [10, 2]]},
+                             {"command": "stream_data", "stream_name": "s", "samples": {"0": 1}},
+                             {"command": "stream_data", "stream_name": "s", "samples": [["a", 1]]})
+        return handled, sent(plain), sent(batched)
+    handled, plain, batched = asyncio.run(run())
+    assert handled == 3  # Malformed batches are logged, not fatal to the producer
+    assert [m["data"] for m in plain] == [2] and "samples" not in plain[0]
+    assert [m["data"] for m in batched] == [2]
+    assert [value for _, value in batched[0]["samples"]] == [1, 2]
@@ -0,0 +1,106 @@
+import itertools
+
+import pytest
+
+from topic_matcher import TopicTrie, is_wildcard, topic_matches, validate_pattern
+
+PATTERNS = ["#", "a/#", "a/+", "a/+/c", "+/b/#", "a/b/c", "+", "+/+", "a/b/#", "x/#"]
+TOPICS = ["a", "b", "a/b", "a/c", "a/b/c", "a/b/c/d", "x", "x/y/z", "b/b", "q/b/c"]
+
+
+def test_trie_agrees_with_topic_matches():
+    trie = TopicTrie()
+    for pattern in PATTERNS:
+        if is_wildcard(pattern):
+            trie.add(pattern)
+    for topic in TOPICS:
+        expected = {p for p in PATTERNS if is_wildcard(p) and topic_matches(p, topic)}
+        assert set(trie.match(topic)) == expected, topic
+
+
+def test_hash_matches_parent_level():
+    assert topic_matches("a/#", "a")
+    assert topic_matches("a/#", "a/b/c")
+    assert not topic_matches("a/#", "ab")
+    trie = TopicTrie()
+    trie.add("a/#")
+    assert trie.match("a") == ("a/#",)
+
+
+def test_plus_matches_exactly_one_level():
+    assert topic_matches("a/+", "a/b")
+    assert not topic_matches("a/+", "a")
+    assert not topic_matches("a/+", "a/b/c")
+
+
+def test_remove_prunes_empty_branches():
+    trie = TopicTrie()
+    trie.add("a/+/c")
+    trie.add("a/#")
+    trie.remove("a/+/c")
+    assert len(trie) == 1
+    assert "+" not in trie.root.children["a"].children
+    trie.remove("a/#")
+    assert len(trie) == 0
+    assert not trie.root.children
+
+
+def test_remove_unknown_pattern_is_a_no_op():
+    trie = TopicTrie()
+    trie.add("a/+")
+    trie.remove("a/b")
+    trie.remove("a")
+    trie.remove("a/+/c")
+    assert len(trie) == 1
+    assert trie.match("a/b") == ("a/+",)
+
+
+def test_adding_the_same_pattern_twice_counts_once():
+    trie = TopicTrie()
+    trie.add("a/+")
+    trie.add("a/+")
+    assert len(trie) == 1
+    trie.remove("a/+")
+    assert len(trie) == 0
+
+
+def test_cache_is_invalidated_when_patterns_change():
+    trie = TopicTrie()
+    trie.add("a/+")
+    assert trie.match("a/b") == ("a/+",)
+    trie.add("+/b")
+    assert set(trie.match("a/b")) == {"a/+", "+/b"}
+    trie.remove("a/+")
+    assert trie.match("a/b") == ("+/b",)
+
+
+def test_forget_drops_cached_topic():
+    trie = TopicTrie()
+    trie.add("a/+")
+    trie.match("a/b")
+    trie.forget("a/b")
+    assert "a/b" not in trie.cache
+
+
+@pytest.mark.parametrize("pattern", ["a/#/b", "a/b#", "a+/b", "#/a"])
+def test_invalid_patterns(pattern):
+    with pytest.raises(ValueError):
+        validate_pattern(pattern)
+    with pytest.raises(ValueError):
+        TopicTrie().add(pattern)
+
+
+def test_every_generated_pattern_agrees():
+    # All patterns of up to three levels over a small alphabet, against all topics of up to three levels
+    levels = ["a", "b", "+"]
+    patterns = set()
+    for depth in range(1, 4):
+        for combo in itertools.product(levels, repeat=depth):
+            patterns.add("/".join(combo))
+            patterns.add("/".join(combo[:-1] + ("#",)))
+    topics = ["/".join(combo) for depth in range(1, 4) for combo in itertools.product("ab", repeat=depth)]
+    trie = TopicTrie()
+    for pattern in patterns:
+        trie.add(pattern)
+    for topic in topics:
+        assert set(trie.match(topic)) == {p for p in patterns if topic_matches(p, topic)}, topic
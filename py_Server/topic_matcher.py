@@ -0,0 +1,120 @@
+"""Wildcard matching of hierarchical stream names.
+
+Stream names can be split into levels with "/", e.g. `room3/esp32-A/temp`.
+Subscription patterns may use MQTT-style wildcards:
+
+- `+` matches exactly one level: `room3/+/temp`
+- `#` matches any number of trailing levels, including none: `room3/#`
+
+`TopicTrie` indexes the wildcard patterns in a trie, so matching a stream
+name walks at most a few branches per level, and caches the result per
+stream name until the set of patterns changes. Exact names are not stored
+here; they are looked up directly.
+"""
+
+
+def is_wildcard(pattern):
+    return "+" in pattern or "#" in pattern
+
+
+def validate_pattern(pattern):
+    """Raise ValueError if wildcards are used anywhere but as whole levels (and `#` last)."""
+    levels = pattern.split("/")
+    for i, level in enumerate(levels):
+        if level in ("+", "#"):
+            if level == "#" and i != len(levels) - 1:
+                raise ValueError("'#' must be the last level of a pattern")
+        elif "+" in level or "#" in level:
+            raise ValueError("wildcards must take up a whole level")
+
+
+def topic_matches(pattern, topic):
+    """Check one pattern against one stream name without building a trie."""
+    pattern_levels = pattern.split("/")
+    levels = topic.split("/")
+    for i, level in enumerate(pattern_levels):
+        if level == "#":
+            return True
+        if i >= len(levels) or (level != "+" and level != levels[i]):
+            return False
+    return len(pattern_levels) == len(levels)
+
+
+class Node:
+    __slots__ = ("children", "pattern")
+
+    def __init__(self):
+        self.children = {}  # Level -> Node; "+" and "#" are wildcard children
+        self.pattern = None  # The pattern that ends at this node, if any
+
+
+class TopicTrie:
+    def __init__(self):
+        self.root = Node()
+        self.size = 0  # Number of patterns
+        self.cache = {}  # Stream name -> tuple of matching patterns
+
+    def __len__(self):
+        return self.size
+
+    def add(self, pattern):
+        validate_pattern(pattern)
+        node = self.root
+        for level in pattern.split("/"):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = Node()
+            node = child
+        if node.pattern is None:
+            self.size += 1
+        node.pattern = pattern
+        self.cache.clear()
+
+    def remove(self, pattern):
+        path = [self.root]
+        for level in pattern.split("/"):
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].pattern is None:
+            return
+        path[-1].pattern = None
+        self.size -= 1
+        # Prune nodes that no longer lead to any pattern
+        for parent, level, node in zip(reversed(path[:-1]), reversed(pattern.split("/")), reversed(path[1:])):
+            if node.pattern is not None or node.children:
+                break
+            del parent.children[level]
+        self.cache.clear()
+
+    def match(self, topic):
+        """Return the patterns that match a stream name."""
+        patterns = self.cache.get(topic)
+        if patterns is None:
+            patterns = self.cache[topic] = tuple(self.walk(topic.split("/")))
+        return patterns
+
+    def walk(self, levels):
+        matches = []
+        pending = [(self.root, 0)]
+        while pending:
+            node, depth = pending.pop()
+            rest = node.children.get("#")
+            if rest is not None and rest.pattern is not None:
+                matches.append(rest.pattern)
+            if depth == len(levels):
+                if node.pattern is not None:
+                    matches.append(node.pattern)
+                continue
+            child = node.children.get(levels[depth]) if levels[depth] != "+" else None
+            if child is not None:
+                pending.append((child, depth + 1))
+            child = node.children.get("+")
+            if child is not None:
+                pending.append((child, depth + 1))
+        return matches
+
+    def forget(self, topic):
+        """Drop the cached matches of a stream that was closed."""
+        self.cache.pop(topic, None)
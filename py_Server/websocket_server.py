@@ -1,226 +1,999 @@
 import asyncio
 import websockets
-import json
 import logging
+import re
 import socket
+import time
 
-from typing import TYPE_CHECKING, Dict, Any
-if TYPE_CHECKING:
-    from server_app import ServerApp
+import json_codec
+from binary_protocol import FrameError, decode_frame
+from client_connection import ClientConnection, DROP_OLDEST
+from command_registry import CommandError, commands
+from metrics import MetricsHTTPServer, MetricsRegistry
+from stream_history import StreamHistory
+from stream_recorder import StreamRecorder, read_recording, replay
+from subscriptions import Subscription, compute_aggregates
+from topic_matcher import TopicTrie, is_wildcard, topic_matches
+from publish_policy import KEYFRAME, SUPPRESS, PublishPolicy, compute_delta
+from server_events import ServerEvents
+from sessions import SessionStore
+from typing import Dict, Any, Optional
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
 
+# The usual single-value stream_data message, as sent by the ESP32 client: command, stream_name,
+# optional client_id and a number or plain string as data, in this order and without escapes
+STREAM_DATA_FRAME = re.compile(
+    r'\{\s*"command"\s*:\s*"stream_data"\s*,\s*"stream_name"\s*:\s*"([^"\\]*)"\s*,'
+    r'(?:\s*"client_id"\s*:\s*"[^"\\]*"\s*,)?'
+    r'\s*"data"\s*:\s*(?:"([^"\\]*)"|(-?(?:0|[1-9][0-9]*))|(-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?))'
+    r'\s*\}\s*\Z'
+)
+
+
+def sniff_stream_data(message):
+    """Return (stream_name, value) if `message` is a plain stream_data message, else None.
+
+    Lets the hottest message skip full JSON decoding and command dispatch.
+    """
+    match = STREAM_DATA_FRAME.match(message)
+    if match is None:
+        return None
+    stream_name, text, integer, number = match.groups()
+    if text is not None:
+        return stream_name, text
+    if integer is not None:
+        return stream_name, int(integer)
+    return stream_name, float(number)
 
 
 class WebSocketServer:
-    def __init__(self, app: 'ServerApp'):
-        self.app = app  # Reference to the ServerApp instance
+    def __init__(self, events: Optional[ServerEvents] = None):
+        self.events = events if events is not None else ServerEvents()  # Receives log and state notifications (e.g. the GUI)
         self.port = 8080
+        self.reuse_port = False  # Let several processes listen on the same port (SO_REUSEPORT)
         self.host = None
         self.server = None
         self.loop = None
         self.should_stop = False
-        self.clients: Dict[str, Any] = {}  # Dictionary to store client ID and WebSocket pairs
+        self.stop_event: Optional[asyncio.Event] = None  # Set by stop() to end main()
+        self.close_timeout = 2.0  # Seconds each client gets to flush and close on shutdown before it is dropped
+        self.clients: Dict[str, ClientConnection] = {}  # Dictionary to store client ID and connection pairs
+        self.send_queue_size = 256  # Maximum number of outbound messages queued per client
+        self.overflow_policy = DROP_OLDEST  # What to do when a client's send queue is full
         self.streams: Dict[str, Any] = {}  # Dictionary to store active streams and their current values
-        
+        self.subscribers: Dict[str, Dict[str, Subscription]] = {}  # Stream name or pattern -> client ID -> subscription
+        self.topic_matcher = TopicTrie()  # Wildcard patterns that have subscribers
+        self.stream_ids: Dict[str, int] = {}  # Stream name -> numeric ID used by binary frames
+        self.stream_names: Dict[int, str] = {}  # Numeric stream ID -> stream name
+        self.next_stream_id = 1
+        self.history_capacity = 1024  # Number of samples kept per stream for request_stream_history
+        self.stream_history: Dict[str, StreamHistory] = {}  # Stream name -> recent samples
+        self.publish_policies: Dict[str, PublishPolicy] = {}  # Stream name -> which updates reach subscribers
+        self.sent_values: Dict[str, Any] = {}  # Stream name -> value last pushed to subscribers
+        self.record_directory: Optional[str] = None  # Record every stream's samples here when set
+        self.recorder: Optional[StreamRecorder] = None
+        self.replays: Dict[str, asyncio.Task] = {}  # Target stream name -> replay task
+        self.commands = commands  # Command name -> handler, see command_registry
+        self.heartbeat_interval: Optional[float] = 15.0  # Ping clients that have been quiet this long (seconds)
+        self.idle_timeout: Optional[float] = 60.0  # Disconnect clients quiet this long, pongs included
+        self.session_ttl = 300.0  # Seconds a disconnected client's session stays resumable
+        self.sessions = SessionStore()
+        self.reaper_task = None
+        self.metrics = MetricsRegistry()
+        self.metrics_host = "127.0.0.1"
+        self.metrics_port: Optional[int] = None  # Serve /metrics over HTTP on this port when set
+        self.metrics_server: Optional[MetricsHTTPServer] = None
+        self.register_metrics()
+
+    def register_metrics(self):
+        metrics = self.metrics
+        self.messages_received = metrics.counter("ws_messages_received_total", "Messages received, by command", "command")
+        self.command_seconds = metrics.histogram("ws_command_seconds", "Time spent handling a message, by command", "command")
+        self.decode_seconds = metrics.histogram("ws_json_decode_seconds", "Time spent decoding incoming JSON")
+        self.stream_updates = metrics.counter("ws_stream_updates_total", "Stream values published, by stream", "stream")
+        self.stream_suppressed = metrics.counter("ws_stream_updates_suppressed_total",
+                                                 "Stream values not pushed because of the stream's publish policy", "stream")
+        metrics.gauge("ws_stream_suppression_ratio", "Fraction of a stream's values not pushed to subscribers",
+                      self.suppression_ratios, "stream")
+        self.fan_out_seconds = metrics.histogram("ws_fan_out_seconds", "Time to queue one stream update for all subscribers")
+        metrics.gauge("ws_clients", "Connected clients", lambda: len(self.clients))
+        metrics.gauge("ws_streams", "Open streams", lambda: len(self.streams))
+        metrics.gauge("ws_sessions", "Resumable client sessions", lambda: len(self.sessions))
+        metrics.gauge("ws_subscriptions", "Stream subscriptions",
+                      lambda: sum(len(subscribers) for subscribers in self.subscribers.values()))
+        # Client IDs can be any JSON value, but JSON object keys must be strings
+        metrics.gauge("ws_send_queue_depth", "Messages waiting in a client's send queue",
+                      lambda: {str(cid): len(c.queue) for cid, c in self.clients.items()}, "client")
+        metrics.gauge("ws_send_queue_dropped", "Messages dropped from a client's full send queue",
+                      lambda: {str(cid): c.dropped for cid, c in self.clients.items()}, "client")
+
+    def suppression_ratios(self):
+        updates = self.stream_updates.values
+        return {name: suppressed / updates[name] for name, suppressed in self.stream_suppressed.values.items()
+                if updates.get(name)}
+
+    def record_command(self, command, started):
+        """Count a handled message and the time since `started` (a perf_counter value)."""
+        self.messages_received.inc(command)
+        self.command_seconds.observe(time.perf_counter() - started, command)
+
     async def register(self, websocket):
-        await websocket.send(json.dumps({"command": "REQUEST_ID"}))
+        await websocket.send(json_codec.dumps({"command": "REQUEST_ID"}))
+        client_id = None
+        connection = None
         try:
             message = await websocket.recv()
-            data = json.loads(message)
+            data = json_codec.loads(message)
             client_id = data.get("client_id")
 
+            # A reconnecting client can answer with its session token instead of a client_id
+            session = None
+            if data.get("command") == "resume":
+                session = self.sessions.resume(data.get("session"))
+                if session is not None:
+                    client_id = session.client_id
+
             if client_id:
-                self.clients[client_id] = websocket
-                self.app.log_message(f"New client connected: ID {client_id}")
-                self.app.add_client(client_id)  # Update the client list in the GUI
+                connection = ClientConnection(client_id, websocket, self.send_queue_size, self.overflow_policy)
+                self.add_connection(connection)
+                if session is not None:
+                    self.resume_session(connection, session)
+                elif data.get("command") == "resume" or data.get("session") is True:
+                    self.start_session(connection)
                 await self.listen_to_client(client_id, websocket)
 
         except websockets.ConnectionClosed as e:
-            self.app.log_message(f"Connection closed: {e}")
+            logging.warning(f"Connection closed: {e}")
+            self.events.log_message(f"Connection closed: {e}")
         except Exception as e:
-            self.app.log_message(f"Error: {e}")
+            logging.error(f"Error: {e}")
+            self.events.log_message(f"Error: {e}")
         finally:
-            if client_id in self.clients:
-                self.clients.pop(client_id)
-                self.app.log_message(f"Client disconnected: ID {client_id}")
-                self.app.remove_client(client_id)
+            if connection is not None:
+                if self.clients.get(client_id) is connection:
+                    await self.remove_connection(client_id)
+                else:
+                    await connection.stop()  # Replaced by a newer connection with the same ID
+
+    def add_connection(self, connection):
+        """Start a registered client's writer and make it addressable by ID."""
+        client_id = connection.client_id
+        previous = self.clients.get(client_id)
+        if previous is not None:
+            # The client reconnected before its old connection was noticed to be dead
+            logging.info(f"Client {client_id} reconnected, closing its previous connection")
+            previous.abort()
+            self.events.client_disconnected(client_id)
+        connection.start()
+        self.clients[client_id] = connection
+        logging.info(f"New client connected: ID {client_id}")
+        self.events.log_message(f"New client connected: ID {client_id}")
+        self.events.client_connected(client_id)
+
+    async def remove_connection(self, client_id):
+        """Forget a disconnected client and everything it subscribed to."""
+        connection = self.clients.pop(client_id)
+        await connection.stop()
+        session = self.sessions.get(client_id)
+        if session is not None:
+            # Keep the subscriptions so a resumed session gets them back
+            session.subscriptions = [subs[client_id] for subs in self.subscribers.values() if client_id in subs]
+            for subscription in session.subscriptions:
+                # Whatever the old connection still had queued was lost with it
+                subscription.reset()
+            self.sessions.release(client_id, self.session_ttl)
+        self.remove_subscriptions(client_id)
+        logging.info(f"Client disconnected: ID {client_id}")
+        self.events.log_message(f"Client disconnected: ID {client_id}")
+        self.events.client_disconnected(client_id)
+
+    def start_session(self, connection):
+        session = self.sessions.create(connection.client_id)
+        self.send_session(connection, session, resumed=False)
+
+    def resume_session(self, connection, session):
+        """Restore a reconnected client's subscriptions and tell it which of its streams are still open."""
+        for subscription in session.subscriptions:
+            subscription.reset()
+            self.add_subscription(subscription)
+        session.subscriptions = []
+        self.send_session(connection, session, resumed=True)
+        log_message = f"Client {session.client_id} resumed its session"
+        logging.info(log_message)
+        self.events.log_message(log_message)
+
+    def send_session(self, connection, session, resumed):
+        # Streams map to their binary stream ID (or None), so binary producers can carry on sending
+        streams = {name: self.stream_ids.get(name) for name in session.streams if name in self.streams}
+        connection.send(json_codec.dumps({
+            "command": "session",
+            "session": session.token,
+            "client_id": session.client_id,
+            "resumed": resumed,
+            "streams": streams
+        }))
 
     async def listen_to_client(self, client_id, websocket):
+        connection = self.clients[client_id]
         try:
             async for message in websocket:
-                data = json.loads(message)
+                started = time.perf_counter()
+                connection.last_seen = time.monotonic()
+                if isinstance(message, bytes):
+                    await self.handle_binary(client_id, message)
+                    self.record_command("binary", started)
+                    continue
+                sniffed = sniff_stream_data(message) if self.stream_data_is_builtin() else None
+                if sniffed is not None and not is_wildcard(sniffed[0]):  # Patterns take the slow path and are rejected
+                    await self.publish_stream(*sniffed)
+                    self.record_command("stream_data", started)
+                    continue
+                data = json_codec.loads(message)
+                decoded = time.perf_counter()
+                self.decode_seconds.observe(decoded - started)
                 await self.handle_message(client_id, data)
+                command = data.get("command") if isinstance(data, dict) else None
+                self.record_command(command if self.commands.get(command) else "unknown", decoded)
         except websockets.ConnectionClosed as e:
             logging.warning(f"Connection closed: {e}")
-            self.app.log_message(f"Connection closed: {e}")
+            self.events.log_message(f"Connection closed: {e}")
         except Exception as e:
             logging.error(f"Error: {e}")
-            self.app.log_message(f"Error: {e}")
+            self.events.log_message(f"Error: {e}")
+
+    def stream_data_is_builtin(self):
+        """True unless a module re-registered "stream_data"; the fast path must not bypass its handler."""
+        entry = self.commands.get("stream_data")
+        return entry is not None and entry.handler is WebSocketServer.handle_stream_data
 
     async def handle_message(self, client_id, data):
+        """Dispatch a decoded message to the handler registered for its command."""
+        if not isinstance(data, dict):
+            log_message = f"Invalid message from {client_id}: expected a JSON object"
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+            return
         command = data.get("command")
+        entry = self.commands.get(command)
+        if entry is None:
+            log_message = f"Unknown command from {client_id}: {command}"
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+            return
+        try:
+            entry.validate(data)
+        except CommandError as e:
+            log_message = f"Invalid '{command}' message from {client_id}: {e}"
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+            return
+        await entry.handler(self, client_id, data)
 
-        if command == "send_to_client":
-            target_id = data.get("target_id")
-            target_client = self.clients.get(target_id)
-            if target_client:
-                await target_client.send(json.dumps(data))
-                log_message = f"Message from {client_id} sent to {target_id}"
-                logging.info(log_message)
-                self.app.log_message(log_message)
-            else:
-                log_message = f"Client {target_id} not found."
+    @commands.command("send_to_client", target_id=(str, int))
+    async def handle_send_to_client(self, client_id, data):
+        target_id = data["target_id"]
+        if target_id not in self.clients:
+            target_id = str(target_id)  # Numeric client IDs may arrive unquoted
+        if self.deliver(target_id, json_codec.dumps(data)):
+            log_message = f"Message from {client_id} sent to {target_id}"
+            logging.info(log_message)
+            self.events.log_message(log_message)
+        else:
+            log_message = f"Client {target_id} not found."
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+
+    @commands.command("start_stream", stream_name=str)
+    async def handle_start_stream(self, client_id, data):
+        stream_name = data["stream_name"]
+        if self.reject_wildcard_name(client_id, stream_name):
+            return
+        self.open_stream(stream_name)
+        if "publish" in data:
+            self.set_publish_policy_from_message(client_id, stream_name, data["publish"])
+        session = self.sessions.get(client_id)
+        if session is not None:
+            session.streams.add(stream_name)
+        log_message = f"Stream '{stream_name}' started by {client_id}"
+        logging.info(log_message)
+        self.events.log_message(log_message)
+
+        # Producers that want to send binary frames get a numeric stream ID back
+        if data.get("binary"):
+            stream_id = self.assign_stream_id(stream_name)
+            self.clients[client_id].send(json_codec.dumps({
+                "command": "stream_id",
+                "stream_name": stream_name,
+                "stream_id": stream_id
+            }))
+
+    def reject_wildcard_name(self, client_id, stream_name):
+        """Log and return True if a producer used a pattern as a stream name."""
+        if not is_wildcard(stream_name):
+            return False
+        log_message = f"Stream name '{stream_name}' from {client_id} must not contain wildcards"
+        logging.warning(log_message)
+        self.events.log_message(log_message)
+        return True
+
+    @commands.command("stream_data", stream_name=str)
+    async def handle_stream_data(self, client_id, data):
+        stream_name = data["stream_name"]
+        if self.reject_wildcard_name(client_id, stream_name):
+            return
+        batch = data.get("samples")
+
+        if batch:
+            # A batch is a list of [device_time_ms, value] pairs, oldest first
+            try:
+                if not isinstance(batch, list):
+                    raise TypeError("samples must be a list")
+                last_time = batch[-1][0]
+                samples = self.align_samples([last_time - t for t, _ in batch], [v for _, v in batch])
+            except (TypeError, ValueError):
+                log_message = f"Malformed sample batch for stream '{stream_name}' from {client_id}"
                 logging.warning(log_message)
-                self.app.log_message(log_message)
+                self.events.log_message(log_message)
+                return
+            await self.publish_stream(stream_name, samples[-1][1], samples)
+        else:
+            await self.publish_stream(stream_name, data.get("data"))
+
+    @commands.command("subscribe_stream", stream_name=str)
+    async def handle_subscribe_stream(self, client_id, data):
+        stream_name = data["stream_name"]
+        try:
+            subscription = Subscription.from_message(client_id, data)
+        except (TypeError, ValueError) as e:
+            log_message = f"Invalid subscription to '{stream_name}' from {client_id}: {e}"
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+            return
 
-        elif command == "start_stream":
-            stream_name = data.get("stream_name")
-            self.streams[stream_name] = None  # Initialize the stream with no data
-            self.app.refresh_stream_dropdown()  # Refresh the stream dropdown in the UI
-            log_message = f"Stream '{stream_name}' started by {client_id}"
+        self.add_subscription(subscription)
+        log_message = f"Client {client_id} subscribed to stream '{stream_name}'"
+        logging.info(log_message)
+        self.events.log_message(log_message)
+
+        # Send the current value right away so the subscriber doesn't wait for the next sample
+        for name in self.matching_streams(stream_name):
+            if self.streams[name] is not None:
+                self.clients[client_id].send(self.encode_stream_data(name, self.streams[name]), name)
+
+    def matching_streams(self, pattern):
+        """Names of the open streams that a stream name or wildcard pattern refers to."""
+        if not is_wildcard(pattern):
+            return [pattern] if pattern in self.streams else []
+        return [name for name in self.streams if topic_matches(pattern, name)]
+
+    @commands.command("unsubscribe_stream", stream_name=str)
+    async def handle_unsubscribe_stream(self, client_id, data):
+        stream_name = data["stream_name"]
+        if self.remove_subscription(stream_name, client_id):
+            log_message = f"Client {client_id} unsubscribed from stream '{stream_name}'"
             logging.info(log_message)
-            self.app.log_message(log_message)
-
-        elif command == "stream_data":
-           
-            stream_name = data.get("stream_name")
-            stream_data = data.get("data")
-
-            # Store the stream data in the streams dictionary
-            self.streams[stream_name] = stream_data            
-
-        elif command == "request_stream_data":
-            stream_name = data.get("stream_name")
-            if stream_name in self.streams:
-                current_data = self.streams.get(stream_name)
-                response = {
-                    "command": "stream_data",
-                    "stream_name": stream_name,
-                    "data": current_data
-                }
-                await self.clients[client_id].send(json.dumps(response))
-                #log_message = f"Sent current stream data for '{stream_name}' to {client_id}"
-                #logging.info(log_message)
-                self.app.log_message(log_message)
+            self.events.log_message(log_message)
+
+    @commands.command("set_publish_policy", stream_name=str)
+    async def handle_set_publish_policy(self, client_id, data):
+        self.set_publish_policy_from_message(client_id, data["stream_name"], data)
+
+    def set_publish_policy_from_message(self, client_id, stream_name, options):
+        if stream_name not in self.streams:
+            log_message = f"Stream '{stream_name}' not found."
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+            return
+        try:
+            policy = PublishPolicy.from_options(options)
+        except (AttributeError, TypeError, ValueError) as e:
+            log_message = f"Invalid publish policy for '{stream_name}' from {client_id}: {e}"
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+            return
+        self.set_publish_policy(stream_name, policy)
+        log_message = f"Publish policy of '{stream_name}' set by {client_id}: {policy.to_options() if policy else 'none'}"
+        logging.info(log_message)
+        self.events.log_message(log_message)
+
+    def set_publish_policy(self, stream_name, policy):
+        """Set or clear (policy None) a stream's publish policy."""
+        if policy is None:
+            self.publish_policies.pop(stream_name, None)
+        else:
+            self.publish_policies[stream_name] = policy
+
+    @commands.command("request_stream_data", stream_name=str)
+    async def handle_request_stream_data(self, client_id, data):
+        stream_name = data["stream_name"]
+        names = self.matching_streams(stream_name)
+        for name in names:
+            self.clients[client_id].send(self.encode_stream_data(name, self.streams[name]), name)
+        if not names:
+            log_message = f"Stream '{stream_name}' not found."
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+
+    @commands.command("request_stream_history", stream_name=str)
+    async def handle_request_stream_history(self, client_id, data):
+        stream_name = data["stream_name"]
+        history = self.stream_history.get(stream_name)
+        if history is None:
+            log_message = f"Stream '{stream_name}' not found."
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+            return
+
+        # Either a time window ("seconds" back from now, or absolute "since"/"until") or the last "count" samples.
+        # Numbers may arrive as strings (the Unity client sends every field as one).
+        try:
+            if "seconds" in data:
+                samples = history.window(time.time() - float(data["seconds"]))
+            elif "since" in data:
+                until = data.get("until")
+                samples = history.window(float(data["since"]), None if until is None else float(until))
             else:
-                log_message = f"Stream '{stream_name}' not found."
-                logging.warning(log_message)
-                self.app.log_message(log_message)
-
-        elif command == "close_stream":
-            stream_name = data.get("stream_name")
-            self.app.log_message("stream to close: '{stream_name}'")
-            logging.info("stream to close: '{stream_name}'")
-
-            if stream_name in self.streams:
-                log_message = f"Stream '{stream_name}' closed by {client_id}"
-                del self.streams[stream_name]
-                self.app.refresh_stream_dropdown()  # Refresh the stream dropdown in the UI
-                logging.info(log_message)
-                self.app.log_message(log_message)
-
-        elif command == "broadcast":
-            broadcast_message = data.get("data")
-            await self.broadcast_message(broadcast_message, exclude_client=client_id)
-            log_message = f"Broadcast message: {broadcast_message}"
-            logging.info(log_message)
-            self.app.log_message(log_message)
-            
-        elif command == "message":
-            # Handle generic messages sent from clients
-            message = data.get("data")
-            log_message = f"Message from {client_id}: {message}"
-            logging.info(log_message)
-            self.app.log_message(log_message)
+                count = data.get("count")
+                if count is not None:
+                    count = int(count)
+                    if count < 0:
+                        raise ValueError("count must not be negative")
+                samples = history.last(count)
+        except (TypeError, ValueError) as e:
+            log_message = f"Invalid history request for '{stream_name}' from {client_id}: {e}"
+            logging.warning(log_message)
+            self.events.log_message(log_message)
+            return
+        self.clients[client_id].send(json_codec.dumps({
+            "command": "stream_history",
+            "stream_name": stream_name,
+            "samples": samples
+        }))
 
-        elif command == "client_id":
-            log_message = f"Received client_id command from {client_id}: {data.get('client_id')}"
+    @commands.command("close_stream", stream_name=str)
+    async def handle_close_stream(self, client_id, data):
+        stream_name = data["stream_name"]
+        self.events.log_message(f"stream to close: '{stream_name}'")
+        logging.info(f"stream to close: '{stream_name}'")
+
+        if stream_name in self.streams:
+            log_message = f"Stream '{stream_name}' closed by {client_id}"
+            self.remove_stream(stream_name)
             logging.info(log_message)
-            self.app.log_message(log_message)
+            self.events.log_message(log_message)
 
-        else:
-            log_message = f"Unknown command from {client_id}: {command}"
+    @commands.command("broadcast")
+    async def handle_broadcast(self, client_id, data):
+        broadcast_message = data.get("data")
+        await self.broadcast_message(broadcast_message, exclude_client=client_id)
+        log_message = f"Broadcast message: {broadcast_message}"
+        logging.info(log_message)
+        self.events.log_message(log_message)
+
+    @commands.command("message")
+    async def handle_generic_message(self, client_id, data):
+        # Handle generic messages sent from clients
+        message = data.get("data")
+        log_message = f"Message from {client_id}: {message}"
+        logging.info(log_message)
+        self.events.log_message(log_message)
+
+    @commands.command("replay_recording", stream_name=str)
+    async def handle_replay_recording(self, client_id, data):
+        # Feed a recorded stream back through the fan-out path, into `target` (default: the same stream)
+        stream_name = data["stream_name"]
+        target = data.get("target") or stream_name
+        try:
+            speed = float(data.get("speed", 1))
+        except (TypeError, ValueError):
+            speed = -1
+        if self.record_directory is None or speed < 0:
+            log_message = f"Invalid replay request from {client_id}: {data}"
             logging.warning(log_message)
-            self.app.log_message(log_message)
+            self.events.log_message(log_message)
+            return
+        self.stop_replay(target)
+        self.replays[target] = asyncio.ensure_future(self.replay_recording(stream_name, target, speed))
+
+    @commands.command("stop_replay", stream_name=str)
+    async def handle_stop_replay(self, client_id, data):
+        self.stop_replay(data["stream_name"])
+
+    @commands.command("server_stats")
+    async def handle_server_stats(self, client_id, data):
+        self.clients[client_id].send(json_codec.dumps({
+            "command": "server_stats",
+            "stats": self.metrics.snapshot()
+        }))
+
+    @commands.command("heartbeat")
+    async def handle_heartbeat(self, client_id, data):
+        # Receiving it already counts as activity; the echo lets the client check the server too
+        self.clients[client_id].send('{"command":"heartbeat"}')
+
+    @commands.command("client_id")
+    async def handle_client_id(self, client_id, data):
+        log_message = f"Received client_id command from {client_id}: {data.get('client_id')}"
+        logging.info(log_message)
+        self.events.log_message(log_message)
+
+    async def handle_binary(self, client_id, frame):
+        """Handle a binary stream_data frame (see binary_protocol)."""
+        try:
+            stream_id, timestamps, samples = decode_frame(frame)
+        except FrameError as e:
+            logging.warning(f"Invalid binary frame from {client_id}: {e}")
+            return
+
+        stream_name = self.stream_names.get(stream_id)
+        if stream_name is None:
+            logging.warning(f"Binary frame from {client_id} for unknown stream ID {stream_id}")
+            return
+        if not samples:
+            return
+
+        if timestamps is None:
+            if len(samples) == 1:
+                await self.publish_stream(stream_name, samples[0])
+                return
+            ages = [0] * len(samples)
+        else:
+            # Device timestamps are uint32 milliseconds and may wrap around
+            last_time = timestamps[-1]
+            ages = [(last_time - t) & 0xFFFFFFFF for t in timestamps]
+        await self.publish_stream(stream_name, samples[-1], self.align_samples(ages, samples))
+
+    def align_samples(self, ages_ms, values):
+        """Pair values with server timestamps, anchoring the newest sample at arrival time.
+
+        `ages_ms` is how long before the newest sample each value was taken,
+        which avoids relying on the device clock matching the server's.
+        """
+        received_at = time.time()
+        return [[received_at - age / 1000.0, value] for age, value in zip(ages_ms, values)]
+
+    async def publish_stream(self, stream_name, stream_data, samples=None):
+        """Store the latest value of a stream and push it to subscribers.
+
+        `samples` optionally carries the full batch as [timestamp, value] pairs.
+        """
+        self.streams[stream_name] = stream_data
+        self.stream_updates.inc(stream_name)
+
+        history = self.stream_history.get(stream_name)
+        if history is None:
+            history = self.stream_history[stream_name] = StreamHistory(self.history_capacity)
+        now = time.time()
+        if samples is None:
+            history.append(now, stream_data)
+            if self.recorder is not None:
+                self.recorder.record(stream_name, now, stream_data)
+        else:
+            history.extend(samples)
+            if self.recorder is not None:
+                self.recorder.record_many(stream_name, samples)
+        self.events.stream_updated(stream_name, now, stream_data, samples)
+
+        previous = self.sent_values.get(stream_name)
+        policy = self.publish_policies.get(stream_name)
+        keyframe = samples is not None
+        if policy is not None and samples is None:
+            decision = policy.check(previous, stream_data, now)
+            if decision == SUPPRESS:
+                self.stream_suppressed.inc(stream_name)
+                return
+            keyframe = decision == KEYFRAME
+        self.sent_values[stream_name] = stream_data
+
+        started = time.perf_counter()
+        await self.fan_out_stream(stream_name, stream_data, samples, None if keyframe else previous)
+        self.fan_out_seconds.observe(time.perf_counter() - started)
+
+    async def replay_recording(self, stream_name, target, speed):
+        """Publish a recorded stream's values into `target` with their recorded timing scaled by `speed`."""
+        if self.recorder is not None:
+            await self.recorder.flush()  # Include samples still waiting to be written
+            self.recorder.paused.add(target)  # Don't record the replay into the recording being read
+        try:
+            try:
+                timestamps, values = await asyncio.get_running_loop().run_in_executor(
+                    None, read_recording, self.record_directory, stream_name)
+            except (OSError, ValueError) as e:
+                log_message = f"Cannot replay recording of '{stream_name}': {e}"
+                logging.warning(log_message)
+                self.events.log_message(log_message)
+                return
+            if target not in self.streams:
+                self.open_stream(target)
+            log_message = f"Replaying {len(values)} samples of '{stream_name}' into '{target}'"
+            logging.info(log_message)
+            self.events.log_message(log_message)
+
+            async def publish(value):
+                await self.publish_stream(target, value)
+
+            await replay(publish, timestamps, values, speed)
+            logging.info(f"Replay into '{target}' finished")
+            self.events.log_message(f"Replay into '{target}' finished")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self.recorder is not None:
+                self.recorder.paused.discard(target)
+            if self.replays.get(target) is asyncio.current_task():
+                del self.replays[target]
+
+    def stop_replay(self, target):
+        task = self.replays.pop(target, None)
+        if task is not None:
+            task.cancel()
+
+    def assign_stream_id(self, stream_name):
+        """Return the numeric ID of a stream, allocating one if needed."""
+        stream_id = self.stream_ids.get(stream_name)
+        if stream_id is None:
+            # IDs are 16-bit on the wire; wrap around and skip IDs still in use
+            while self.next_stream_id in self.stream_names:
+                self.next_stream_id = self.next_stream_id % 0xFFFF + 1
+            stream_id = self.next_stream_id
+            self.next_stream_id = self.next_stream_id % 0xFFFF + 1
+            self.stream_ids[stream_name] = stream_id
+            self.stream_names[stream_id] = stream_name
+        return stream_id
+
+    def encode_stream_data(self, stream_name, stream_data, samples=None):
+        """Serialize a stream_data message for the given stream value."""
+        message = {
+            "command": "stream_data",
+            "stream_name": stream_name,
+            "data": stream_data
+        }
+        if samples is not None:
+            message["samples"] = samples
+        return json_codec.dumps(message)
+
+    def encode_stream_delta(self, stream_name, changed, removed):
+        """Serialize a stream_data message carrying only the fields that changed."""
+        message = {
+            "command": "stream_data",
+            "stream_name": stream_name,
+            "delta": changed
+        }
+        if removed:
+            message["removed"] = removed
+        return json_codec.dumps(message)
+
+    async def fan_out_stream(self, stream_name, stream_data, samples=None, delta_base=None):
+        """Push a new stream value to every subscriber, encoding it only once.
+
+        Rate-limited subscriptions are only flagged here; their delivery
+        task sends the value on its own schedule. `delta_base` is the value
+        sent before, if delta subscribers may get just the changed fields.
+        """
+        groups = []
+        subscribers = self.subscribers.get(stream_name)
+        if subscribers:
+            groups.append(subscribers)
+        if len(self.topic_matcher):
+            groups.extend(self.subscribers[pattern] for pattern in self.topic_matcher.match(stream_name))
+        if not groups:
+            return
+        served = set() if len(groups) > 1 else None  # A client matched twice gets the update once
+        message = None  # Latest value only, shared by all plain subscribers
+        batch_message = None  # Latest value and the whole batch, shared by subscribers that asked for samples
+        delta_message = None  # Changed fields only, shared by delta subscribers
+        use_delta = isinstance(delta_base, dict) and isinstance(stream_data, dict)
+        updates = 1 if samples is None else len(samples)
+        for cid, subscription in (item for group in groups for item in group.items()):
+            if served is not None:
+                if cid in served:
+                    continue
+                served.add(cid)
+            if not subscription.immediate:
+                subscription.pending.add(stream_name)
+                continue
+            if not subscription.accept(updates):
+                continue
+            connection = self.clients.get(cid)
+            if connection is None:
+                continue
+            if subscription.delta and subscription.decimate == 1:
+                # Frames for delta subscribers are not keyed by stream: coalescing would reorder
+                # them or merge away the fields of an earlier delta
+                if connection.dropped != subscription.drops_seen:
+                    subscription.drops_seen = connection.dropped
+                    subscription.synced.clear()  # A dropped frame may have been one of ours
+                if use_delta and stream_name in subscription.synced:
+                    if delta_message is None:
+                        changed, removed = compute_delta(delta_base, stream_data)
+                        delta_message = self.encode_stream_delta(stream_name, changed, removed) if changed or removed else ""
+                    if delta_message:
+                        connection.send(delta_message)
+                else:
+                    if message is None:
+                        message = self.encode_stream_data(stream_name, stream_data)
+                    connection.send(message)
+                    subscription.synced.add(stream_name)
+            elif subscription.samples and samples is not None and subscription.decimate == 1:
+                if batch_message is None:
+                    batch_message = self.encode_stream_data(stream_name, stream_data, samples)
+                connection.send(batch_message, stream_name)
+            else:
+                if message is None:
+                    message = self.encode_stream_data(stream_name, stream_data)
+                connection.send(message, stream_name)
+
+    async def deliver_at_rate(self, subscription):
+        """Send a rate-limited subscription its latest value or aggregates at a fixed cadence."""
+        stream_name = subscription.stream_name
+        interval = 1.0 / subscription.rate
+        next_tick = self.loop_time() + interval
+        try:
+            while True:
+                await asyncio.sleep(max(0.0, next_tick - self.loop_time()))
+                next_tick += interval
+                connection = self.clients.get(subscription.client_id)
+                if connection is None:
+                    continue
+
+                if subscription.aggregates:
+                    history = self.stream_history.get(stream_name)
+                    if history is None:
+                        continue
+                    values = history.values_after(subscription.last_delivery)
+                    if not values:
+                        continue
+                    # Aggregate up to the newest sample so the next window starts right after it
+                    subscription.last_delivery = history.latest()[0]
+                    message = json_codec.dumps({
+                        "command": "stream_data",
+                        "stream_name": stream_name,
+                        "data": self.streams.get(stream_name),
+                        "aggregate": compute_aggregates(values, subscription.aggregates)
+                    })
+                    connection.send(message, stream_name)
+                else:
+                    # One stream, or every stream matching a pattern that got a new value
+                    for name in subscription.pending:
+                        connection.send(self.encode_stream_data(name, self.streams.get(name)), name)
+                subscription.pending.clear()
+        except asyncio.CancelledError:
+            pass
+
+    def loop_time(self):
+        return asyncio.get_event_loop().time()
+
+    def open_stream(self, stream_name):
+        """Register a stream with no data yet.
+
+        Re-opening an open stream, e.g. after its producer reconnected,
+        keeps its current value so subscribers see no gap.
+        """
+        if stream_name in self.streams:
+            return
+        self.streams[stream_name] = None
+        self.events.streams_changed(list(self.streams))
+
+    def remove_stream(self, stream_name):
+        """Forget a closed stream's value, history and binary stream ID."""
+        del self.streams[stream_name]
+        self.stream_history.pop(stream_name, None)
+        self.stream_updates.values.pop(stream_name, None)
+        self.stream_suppressed.values.pop(stream_name, None)
+        self.publish_policies.pop(stream_name, None)
+        self.sent_values.pop(stream_name, None)
+        self.stop_replay(stream_name)
+        self.sessions.forget_stream(stream_name)
+        self.topic_matcher.forget(stream_name)
+        if self.recorder is not None:
+            asyncio.ensure_future(self.recorder.close_stream(stream_name))
+        stream_id = self.stream_ids.pop(stream_name, None)
+        if stream_id is not None:
+            del self.stream_names[stream_id]
+        self.events.streams_changed(list(self.streams))
+
+    def add_subscription(self, subscription):
+        """Add or replace a client's subscription to a stream or pattern."""
+        if subscription.stream_name not in self.subscribers and is_wildcard(subscription.stream_name):
+            self.topic_matcher.add(subscription.stream_name)
+        subscribers = self.subscribers.setdefault(subscription.stream_name, {})
+        if subscription.client_id in subscribers:
+            subscribers[subscription.client_id].cancel()  # Re-subscribing replaces the previous options
+        subscribers[subscription.client_id] = subscription
+        if not subscription.immediate:
+            subscription.task = asyncio.ensure_future(self.deliver_at_rate(subscription))
+
+    def remove_subscription(self, stream_name, client_id):
+        """Cancel one subscription; returns False if it did not exist."""
+        subscribers = self.subscribers.get(stream_name)
+        if not subscribers or client_id not in subscribers:
+            return False
+        subscribers.pop(client_id).cancel()
+        if not subscribers:
+            del self.subscribers[stream_name]
+            if is_wildcard(stream_name):
+                self.topic_matcher.remove(stream_name)
+        return True
+
+    def remove_subscriptions(self, client_id):
+        """Drop every stream subscription held by a client."""
+        for stream_name in list(self.subscribers):
+            self.remove_subscription(stream_name, client_id)
+
+    def deliver(self, client_id, frame):
+        """Queue an encoded frame for a client; returns False if the client is unknown."""
+        connection = self.clients.get(client_id)
+        if connection is None:
+            return False
+        connection.send(frame)
+        return True
 
     async def send_to_client(self, client_id, message):
-        client = self.clients.get(client_id)
-        if client:
-            await client.send(json.dumps({"command": "message", "data": message}))
+        if self.deliver(client_id, json_codec.dumps({"command": "message", "data": message})):
             log_message = f"Sent message to {client_id}: {message}"
-            self.app.log_message(log_message)
+            logging.info(log_message)
+            self.events.log_message(log_message)
         else:
             log_message = f"Client {client_id} not found."
-            self.app.log_message(log_message)
+            logging.warning(log_message)
+            self.events.log_message(log_message)
 
     async def broadcast_message(self, message, exclude_client=None):
-        for cid, websocket in self.clients.items():
-            if cid != exclude_client:
-                await websocket.send(json.dumps({
-                    "command": "broadcast",
-                    "data": message
-                }))
+        # Serialize once and hand the same frame to every client's queue
+        frame = json_codec.dumps({
+            "command": "broadcast",
+            "data": message
+        })
+        self.broadcast_frame(frame, exclude_client)
         logging.info(f"Broadcasted message: {message}")
-        self.app.log_message(f"Broadcasted message: {message}")
+        self.events.log_message(f"Broadcasted message: {message}")
+
+    def broadcast_frame(self, frame, exclude_client=None):
+        """Queue an already-encoded frame for every client except `exclude_client`."""
+        for cid, connection in self.clients.items():
+            if cid != exclude_client:
+                connection.send(frame)
 
     async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        if self.should_stop:  # stop() was called before the loop was running
+            self.stop_event.set()
         logging.info("Server started, waiting for clients to connect...")
-        self.app.log_message("Server started, waiting for clients to connect...")
-        self.server = await websockets.serve(self.register, "0.0.0.0", self.port)
-        self.host = self.get_host_ip()
-        self.app.update_IP_config(self.host,self.port)
+        self.events.log_message("Server started, waiting for clients to connect...")
+        # Our own heartbeat replaces the websockets keepalive pings when enabled
+        ping_interval = None if self.heartbeat_interval else 20
+        self.server = await websockets.serve(self.register, "0.0.0.0", self.port,
+                                             reuse_port=self.reuse_port, ping_interval=ping_interval)
+        self.reaper_task = asyncio.ensure_future(self.reap_idle_clients())
+        if self.record_directory is not None:
+            self.recorder = StreamRecorder(self.record_directory)
+            self.recorder.start()
+            logging.info(f"Recording streams to {self.record_directory}")
+        if self.metrics_port is not None:
+            self.metrics_server = MetricsHTTPServer(self.metrics, self.metrics_host, self.metrics_port)
+            await self.metrics_server.start()
+        # Interface discovery can block (e.g. on name resolution), so keep it off the event loop
+        self.host = await self.loop.run_in_executor(None, self.get_host_ip)
+        self.events.server_started(self.host, self.port)
         logging.info(f"host :{self.host}")
         try:
-            while not self.should_stop:
-                await asyncio.sleep(1)
+            await self.stop_event.wait()
         finally:
             logging.info("Server stopping, disconnecting all clients...")
-            self.app.log_message("Server stopping, disconnecting all clients...")
+            self.events.log_message("Server stopping, disconnecting all clients...")
+            self.reaper_task.cancel()
             await self.disconnect_all_clients()
             self.server.close()
             await self.server.wait_closed()
+            for target in list(self.replays):
+                self.stop_replay(target)
+            if self.recorder is not None:
+                await self.recorder.stop()
+            if self.metrics_server is not None:
+                await self.metrics_server.close()
             logging.info("Server has been stopped.")
-            self.app.log_message("Server has been stopped.")
+            self.events.log_message("Server has been stopped.")
+            self.events.server_stopped()
             
+    async def reap_idle_clients(self):
+        """Ping quiet clients, disconnect dead ones and expire lapsed sessions."""
+        try:
+            while True:
+                await asyncio.sleep(self.heartbeat_interval or 10)
+                now = time.monotonic()
+                for client_id, connection in list(self.clients.items()):
+                    idle = now - connection.last_seen
+                    if self.idle_timeout is not None and idle >= self.idle_timeout:
+                        log_message = f"Client {client_id} timed out after {idle:.0f} s without traffic"
+                        logging.warning(log_message)
+                        self.events.log_message(log_message)
+                        connection.abort()
+                    elif self.heartbeat_interval and idle >= self.heartbeat_interval:
+                        asyncio.ensure_future(self.ping_client(connection))
+                for session in self.sessions.expire(now):
+                    logging.info(f"Session of {session.client_id} expired")
+        except asyncio.CancelledError:
+            pass
+
+    async def ping_client(self, connection):
+        """Send a WebSocket ping and count the pong as activity."""
+        try:
+            pong = await connection.websocket.ping()
+            await asyncio.wait_for(pong, self.heartbeat_interval)
+            connection.last_seen = time.monotonic()
+        except (websockets.ConnectionClosed, asyncio.TimeoutError, RuntimeError):
+            pass
+
     def get_host_ip(self):
-        """Get the local IP address of the machine."""
-        try:
-            # This will attempt to connect to an external IP address to determine the local IP
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip_address = s.getsockname()[0]
-            s.close()
-            return ip_address
-        except Exception as e:
+        """Get the LAN IP address of the machine, also without internet access.
+
+        Blocking; main() runs it on an executor thread.
+        """
+        # Connecting a UDP socket sends nothing; it only asks the OS which interface
+        # routes to the address. It fails when there is no route, e.g. offline.
+        for address in ("8.8.8.8", "10.255.255.255"):
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                    s.connect((address, 80))
+                    ip_address = s.getsockname()[0]
+            except OSError:
+                continue
+            if not ip_address.startswith(("0.", "127.")):
+                return ip_address
+        # Otherwise use any non-loopback address the host name resolves to
+        try:
+            for ip_address in socket.gethostbyname_ex(socket.gethostname())[2]:
+                if not ip_address.startswith("127."):
+                    return ip_address
+        except OSError as e:
             logging.error(f"Could not determine IP address: {e}")
-            return "127.0.0.1"  # Fallback to localhost
+        return "127.0.0.1"  # Fallback to localhost
 
     async def disconnect_all_clients(self):
         if self.clients:
             logging.info("Disconnecting all clients...")
-            self.app.log_message("Disconnecting all clients...")
-            disconnect_tasks = []
-            for client_id, websocket in list(self.clients.items()):
-                await websocket.send(json.dumps({"command": "SERVER_CLOSING"}))
-                disconnect_tasks.append(websocket.close())
-            await asyncio.gather(*disconnect_tasks)
+            self.events.log_message("Disconnecting all clients...")
+            frame = json_codec.dumps({"command": "SERVER_CLOSING"})
+            await asyncio.gather(*(self.close_client(connection, frame) for connection in list(self.clients.values())))
             self.clients.clear()
             logging.info("All clients have been disconnected.")
-            self.app.log_message("All clients have been disconnected.")
+            self.events.log_message("All clients have been disconnected.")
+
+    async def close_client(self, connection, frame=None):
+        """Send `frame`, flush the client's queue and close its socket, dropping it after close_timeout."""
+        if frame is not None:
+            connection.send(frame)
+        try:
+            await asyncio.wait_for(self.drain_and_close(connection), self.close_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Client {connection.client_id} did not close in time, dropping it")
+            connection.abort()
+
+    async def drain_and_close(self, connection):
+        await connection.flush()
+        await connection.stop()
+        await connection.websocket.close()
 
     def start(self):
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
+        # Keep a local reference so a restart that replaces self.loop can't make us close the wrong loop
+        loop = self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
         self.should_stop = False
         try:
-            self.loop.run_until_complete(self.main())
+            loop.run_until_complete(self.main())
         finally:
-            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
-            self.loop.close()
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
 
     def stop(self):
+        """Ask the server to shut down and return at once.
+
+        Safe to call from any thread or a signal handler; main() then
+        disconnects the clients, closes the listener and returns.
+        """
         self.should_stop = True
-        if self.server is not None:
-            asyncio.run_coroutine_threadsafe(self.disconnect_all_clients(), self.loop).result()
-            self.server.close()
+        loop = self.loop
+        if loop is not None and self.stop_event is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.stop_event.set)
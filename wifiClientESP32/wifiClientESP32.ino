@@ -24,6 +24,12 @@ const char* stream_name = "esp32Stream1"; // Stream name
 bool stream_active = false;
 String current_stream_mode = "testing_data"; // Default to sensor data mode
 float stream_resolution = 300;  // Default stream data resolution 
+bool use_binary_stream = false; // Send stream samples as compact binary frames
+uint16_t binary_stream_id = 0;  // Numeric stream ID assigned by the server (0 = not assigned)
+String session_token = "";      // Lets a reconnect resume this client's ID and streams in one message
+bool auto_reconnect = true;     // Reconnect automatically when the connection drops
+unsigned long last_reconnect_attempt = 0;
+const unsigned long reconnect_interval = 2000; // Milliseconds between reconnect attempts
 
 void setup() {
     Serial.begin(115200);
@@ -35,7 +41,7 @@ void setup() {
     Serial.println(message.data());
 
     // Attempt to parse the message as JSON
-    StaticJsonDocument<200> doc;
+    StaticJsonDocument<384> doc;
     DeserializationError error = deserializeJson(doc, message.data());
 
     if (error) {
@@ -47,7 +53,18 @@ void setup() {
     String command = doc["command"];
 
     if (command == "REQUEST_ID") {
-          sendClientID();
+          Serial.println("Server requested ID (already sent on connect)");
+      } else if (command == "session") {
+          session_token = doc["session"].as<String>();
+          bool resumed = doc["resumed"];
+          if (resumed && doc["streams"].containsKey(stream_name)) {
+              binary_stream_id = doc["streams"][stream_name] | 0;
+              Serial.println("Session resumed, stream still open");
+          } else if (stream_active) {
+              startStream(stream_name); // New session: open the stream again
+          }
+      } else if (command == "heartbeat") {
+          // Reply to our own heartbeat; nothing to do
       } else if (command == "SERVER_CLOSING") {
           Serial.println("Server is closing, disconnecting...");
           client.close();
@@ -55,6 +72,10 @@ void setup() {
           String broadcast_message = doc["data"];
           Serial.print("Broadcast message from server: ");
           Serial.println(broadcast_message);
+      } else if (command == "stream_id") {
+          binary_stream_id = doc["stream_id"];
+          Serial.print("Binary stream ID: ");
+          Serial.println(binary_stream_id);
       } else if (command == "message"){
           String message = doc["data"];
           Serial.print("Recieve message: ");
@@ -95,6 +116,12 @@ void loop() {
         } else if (input == "switch to testing mode") {
             current_stream_mode = "testing_data";
             Serial.println("Switched to testing mode.");
+        } else if (input == "switch to binary") {
+            use_binary_stream = true;
+            Serial.println("Binary stream frames enabled (takes effect on next start stream).");
+        } else if (input == "switch to json") {
+            use_binary_stream = false;
+            Serial.println("JSON stream messages enabled.");
         } else {
         // Create a JSON object to send
         StaticJsonDocument<200> jsonDoc;
@@ -112,7 +139,11 @@ void loop() {
         Serial.println(jsonString);
       }
     }
-    if(stream_active == true){
+    if (auto_reconnect && !client.available() && millis() - last_reconnect_attempt > reconnect_interval) {
+      last_reconnect_attempt = millis();
+      connectToWebSocket();
+    }
+    if(stream_active == true && client.available()){
       sendStreamData(stream_name,current_stream_mode);
     }
 
@@ -144,8 +175,15 @@ void connectToWebSocket() {
 }
 
 void sendClientID() {
+    // Sent right after connecting, without waiting for REQUEST_ID
     StaticJsonDocument<200> doc;
-    doc["command"] = "client_id";
+    if (session_token.length() > 0) {
+        doc["command"] = "resume";
+        doc["session"] = session_token;
+    } else {
+        doc["command"] = "client_id";
+        doc["session"] = true;
+    }
     doc["client_id"] = client_id;
 
     String jsonString;
@@ -173,6 +211,7 @@ void startStream(const String& stream_name) {
     doc["command"] = "start_stream";
     doc["stream_name"] = stream_name;
     doc["client_id"] = client_id;
+    doc["binary"] = use_binary_stream;
 
     String jsonString;
     serializeJson(doc, jsonString);
@@ -189,6 +228,11 @@ void sendStreamData(const String& stream_name , const String& stream_mode) {
         data = String(random(1, 1000) / 100.0, 2); // Random float between 1.00 and 10.00
     }
 
+    if (use_binary_stream && binary_stream_id != 0) {
+        sendStreamDataBinary(data.toFloat());
+        return;
+    }
+
     StaticJsonDocument<200> doc;
     doc["command"] = "stream_data";
     doc["stream_name"] = stream_name;
@@ -202,6 +246,19 @@ void sendStreamData(const String& stream_name , const String& stream_mode) {
     Serial.println("Sent stream data for " + stream_name + ": " + data);
 }
 
+void sendStreamDataBinary(float value) {
+    // Header: version, sample type, stream ID (uint16), sample count (uint16), then float32 samples
+    uint8_t frame[10];
+    frame[0] = 1;
+    frame[1] = 'f';
+    frame[2] = binary_stream_id & 0xFF;
+    frame[3] = binary_stream_id >> 8;
+    frame[4] = 1;
+    frame[5] = 0;
+    memcpy(frame + 6, &value, sizeof(value)); // ESP32 is little-endian, matching the wire format
+    client.sendBinary((const char*)frame, sizeof(frame));
+}
+
 String getSensorData() {
     // Placeholder for real sensor data acquisition
     // Replace this with actual sensor data reading code
@@ -217,6 +274,7 @@ void closeStream(const String& stream_name) {
     String jsonString;
     serializeJson(doc, jsonString);
     client.send(jsonString);
+    binary_stream_id = 0;
 
     Serial.println("Closed stream " + stream_name);
 }
@@ -229,11 +287,13 @@ void restartESP() {
 
 void reconnectWebSocket() {
     Serial.println("Reconnecting to WebSocket...");
+    auto_reconnect = true;
     client.close();
     connectToWebSocket();
 }
 
 void disconnect() {
     Serial.println("Disconnecting from WebSocket...");
+    auto_reconnect = false;
     client.close();
 }